@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# --------------------
+# benchmark_filters.py
+# --------------------
+# Author:      Daniel Sim (foxhead128)
+# License:     See <http://unlicense.org/> for more details.
+# Description: This script benchmarks Nimbus' ad-block and hosts filtering.
+#              It doesn't need Qt or a network connection; the rule sets and
+#              URLs are generated from a fixed seed, so runs on different
+#              commits can be compared.
+
+import os
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib"))
+
+import abpy
+
+words = ("ad ads adv advert advertising adserver adsystem banner banners "
+         "track tracker tracking pixel analytics stats metrics sponsor "
+         "sponsored promo popup popunder click clicks beacon tag tags "
+         "affiliate partner widget social share counter log logger collect "
+         "event events impression view img image images static cdn media "
+         "assets js css script api v1 v2 content page home news video "
+         "player embed frame iframe load loader core main app bundle vendor "
+         "lib jquery min top side bottom right left header footer box "
+         "skyscraper leaderboard rectangle").split()
+tlds = ("com", "net", "org", "de", "co.uk", "io", "ru", "fr", "info", "biz")
+sizes = ("300x250", "728x90", "160x600", "468x60", "120x600", "320x50")
+extensions = ("js", "css", "png", "gif", "html", "php", "jpg", "")
+element_types = {"js": "script", "css": "stylesheet", "png": "image",
+                 "gif": "image", "jpg": "image", "html": "subdocument"}
+
+def random_word(rng):
+    return rng.choice(words)
+
+def random_domain(rng):
+    return "%s%s%d.%s" % (random_word(rng), random_word(rng), rng.randrange(1000), rng.choice(tlds))
+
+# Generates an EasyList-like list of n rules, in roughly EasyList's mix of
+# host rules, path fragments, options, exceptions and element hiding rules.
+# Returns the lines and the domains that were blocked.
+def generate_rules(rng, n):
+    lines = ["[Adblock Plus 2.0]", "! Title: Synthetic benchmark list"]
+    domains = []
+    for i in range(n):
+        r = rng.random()
+        if r < 0.45:
+            domain = random_domain(rng)
+            domains.append(domain)
+            rule = "||%s^" % domain
+            if rng.random() < 0.2:
+                rule += "$third-party"
+        elif r < 0.60:
+            rule = "/%s/%s_*." % (random_word(rng), random_word(rng))
+        elif r < 0.68:
+            rule = "-%s-%s." % (random_word(rng), rng.choice(sizes))
+        elif r < 0.74:
+            rule = "&%s%s=" % (random_word(rng), random_word(rng))
+        elif r < 0.80:
+            rule = "||%s/%s/%s" % (random_domain(rng), random_word(rng), random_word(rng))
+        elif r < 0.85:
+            rule = "/%s%s.%s?$script,third-party" % (random_word(rng), random_word(rng), rng.choice(("js", "php")))
+        elif r < 0.88:
+            rule = "@@||%s^$script" % random_domain(rng)
+        elif r < 0.94:
+            rule = "##.%s-%s" % (random_word(rng), random_word(rng))
+        elif r < 0.97:
+            rule = "%s##.%s" % (random_domain(rng), random_word(rng))
+        else:
+            rule = "! Comment %d" % i
+        lines.append(rule)
+        # Real lists overlap a little.
+        if rng.random() < 0.05:
+            lines.append(rule)
+    return lines, domains
+
+# Generates a hosts file with n entries.
+def generate_hosts(rng, n):
+    lines = ["# Synthetic benchmark hosts file", "127.0.0.1 localhost"]
+    domains = []
+    for i in range(n):
+        domain = random_domain(rng)
+        domains.append(domain)
+        lines.append("0.0.0.0 %s" % domain)
+    return lines, domains
+
+# Generates n (url, elementtype, document domain) triples. Some of them are
+# on blocked domains or their subdomains.
+def generate_requests(rng, n, domains):
+    requests = []
+    for i in range(n):
+        if domains and rng.random() < 0.15:
+            host = rng.choice(domains)
+            if rng.random() < 0.5:
+                host = random_word(rng) + "." + host
+        else:
+            host = "www." + random_domain(rng)
+        path = "/".join(random_word(rng) for j in range(rng.randrange(1, 5)))
+        ext = rng.choice(extensions)
+        url = "http%s://%s/%s%s" % (rng.choice(("", "s")), host, path, "." + ext if ext else "")
+        if rng.random() < 0.4:
+            url += "?" + "&".join("%s=%d" % (random_word(rng), rng.randrange(10000)) for j in range(rng.randrange(1, 4)))
+        document = host if rng.random() < 0.3 else "www." + random_domain(rng)
+        requests.append((url, element_types.get(ext), document))
+    return requests
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.0))]
+
+# Calls build() once under tracemalloc for the peak memory, and again
+# without it for the build time, since tracing slows allocation down.
+def measure_build(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    gc.collect()
+    start = time.perf_counter()
+    result = build()
+    build_time = time.perf_counter() - start
+    return result, build_time, peak
+
+# Times match() on every item separately, then the whole corpus in one loop
+# for the throughput.
+def measure_matching(match, items):
+    timer = time.perf_counter
+    latencies = []
+    blocked = 0
+    for item in items:
+        start = timer()
+        verdict = match(item)
+        latencies.append(timer() - start)
+        if verdict:
+            blocked += 1
+    latencies.sort()
+    start = timer()
+    for item in items:
+        match(item)
+    elapsed = timer() - start
+    return {"requests": len(items),
+            "blocked": blocked,
+            "p50_us": percentile(latencies, 50) * 1e6,
+            "p99_us": percentile(latencies, 99) * 1e6,
+            "max_us": latencies[-1] * 1e6 if latencies else 0.0,
+            "mean_us": sum(latencies) / max(1, len(latencies)) * 1e6,
+            "throughput_per_s": len(items) / elapsed if elapsed else 0.0}
+
+def benchmark_adblock(rng, rule_count, request_count):
+    lines, domains = generate_rules(rng, rule_count)
+    requests = generate_requests(rng, request_count, domains)
+    adblock_filter, build_time, peak = measure_build(lambda: abpy.Filter(lines))
+    results = {"lines": len(lines),
+               "rules": len(adblock_filter.blocking) + len(adblock_filter.exceptions),
+               "hiding_rules": len(adblock_filter.hiding_generic) + adblock_filter.hiding_count(),
+               "build_s": build_time,
+               "peak_memory_mb": peak / 1048576.0}
+    results.update(measure_matching(lambda request: adblock_filter.match(*request), requests))
+    return results
+
+def benchmark_hosts(rng, host_count, request_count):
+    lines, domains = generate_hosts(rng, host_count)
+    hosts = [abpy.get_host(request[0]) for request in generate_requests(rng, request_count, domains)]
+    def build():
+        host_filter = abpy.HostFilter()
+        for line in lines:
+            host_filter.add_line(line)
+        return host_filter
+    host_filter, build_time, peak = measure_build(build)
+    results = {"lines": len(lines),
+               "hosts": len(host_filter),
+               "build_s": build_time,
+               "peak_memory_mb": peak / 1048576.0}
+    results.update(measure_matching(host_filter.match, hosts))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Nimbus' ad-block and hosts filtering.")
+    parser.add_argument("--rules", type=int, default=60000, help="number of ad-block rules (default: %(default)s)")
+    parser.add_argument("--hosts", type=int, default=60000, help="number of hosts file entries (default: %(default)s)")
+    parser.add_argument("--requests", type=int, default=20000, help="number of requests to replay (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (default: %(default)s)")
+    parser.add_argument("--output", "-o", help="save the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {"python": platform.python_version(),
+               "platform": platform.platform(),
+               "seed": args.seed,
+               "adblock": benchmark_adblock(random.Random(args.seed), args.rules, args.requests),
+               "hosts": benchmark_hosts(random.Random(args.seed), args.hosts, args.requests)}
+
+    for name in ("adblock", "hosts"):
+        r = results[name]
+        print("%s: built in %.3fs, peak %.1fMB; p50 %.1fus, p99 %.1fus, %d requests/s, %d/%d blocked" %
+              (name, r["build_s"], r["peak_memory_mb"], r["p50_us"], r["p99_us"],
+               r["throughput_per_s"], r["blocked"], r["requests"]))
+
+    if args.output:
+        f = open(args.output, "w")
+        try: json.dump(results, f, indent=2, sort_keys=True)
+        finally: f.close()
+
+if __name__ == "__main__":
+    main()
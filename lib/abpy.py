@@ -12,8 +12,10 @@ directly with an array of AdBlock Plus rules, instead of using a file object.
 """
 
 from __future__ import print_function
+import os
 import re
 import sys
+import pickle
 
 if sys.version_info[0] > 2:
     def unicode(*args, **kwargs):
@@ -21,10 +23,24 @@ if sys.version_info[0] > 2:
 
 RE_TOK = re.compile('\W')
 
+# Splits a rule pattern into the literal fragments between wildcards,
+# separators and anchors.
+RE_LITERAL = re.compile(r'[*^|]+')
 
-MAP_RE = (('\|\|','(//|\.)'),
-          ('\^', r'[/\\:+!@#\$^\^&\*\(\)\|]'),
-          ('\*', r'.*'))
+# Literal fragments shorter than this are too common to be worth indexing.
+KEYWORD_MIN_LENGTH = 3
+
+# Matches rules of the form ||example.com^, which block a host and all of
+# its subdomains.
+RE_HOST_RULE = re.compile(r'^\|\|([a-z0-9.-]+)\^$')
+
+# Keywords are truncated to this length to keep the automaton small.
+KEYWORD_MAX_LENGTH = 16
+
+
+# Regex fragments for the special characters of Adblock Plus patterns.
+RE_HOST_ANCHOR = r'^[\w\-]+:/+(?!/)(?:[^/]+\.)?'
+RE_SEPARATOR = r'(?:[\x00-\x24\x26-\x2C\x2F\x3A-\x40\x5B-\x5E\x60\x7B-\x7F]|$)'
 
 class RuleSyntaxError(Exception):
     pass
@@ -36,84 +52,689 @@ TYPE_OPTS = (('script', 'external scripts loaded via HTML script tag'),
              ('xmlhttprequest', 'requests started by the XMLHttpRequest object'),
              ('object-subrequest', 'requests started plugins like Flash'),
              ('subdocument', 'embedded pages, usually included via HTML frames'),
+             ('media', 'regular media files, typically loaded via HTML video or audio tags'),
+             ('font', 'external font files'),
+             ('ping', 'requests started by a link with a ping attribute'),
+             ('websocket', 'requests initiated via WebSocket objects'),
              ('document', 'the page itself (only exception rules can be applied to the page)'),
              ('elemhide', 'for exception rules only, similar to document but only disables element hiding rules on the page rather than all filter rules (Adblock Plus 1.2 and higher required)'),
+             ('generichide', 'for exception rules only, similar to elemhide but only disables generic element hiding rules on the page'),
+             ('genericblock', 'for exception rules only, similar to document but only disables generic blocking rules on the page'),
+             ('popup', 'pages opened in a new tab or window'),
              ('other', 'types of requests not covered in the list above'))
 TYPE_OPT_IDS = [x[0] for x in TYPE_OPTS]
 
+# Each request type gets one bit, so that a rule's types are a single int.
+TYPE_BITS = dict((name, 1 << i) for i, name in enumerate(TYPE_OPT_IDS))
+TYPE_BITS['background'] = TYPE_BITS['image']
+TYPE_BITS['object_subrequest'] = TYPE_BITS['object-subrequest']
+TYPE_BITS['xbl'] = TYPE_BITS['dtd'] = TYPE_BITS['other']
+
+# Types that apply to a whole page rather than to requests. Exception rules
+# with only these types never allow a request by themselves.
+PAGE_TYPES = ('document', 'elemhide', 'generichide', 'genericblock', 'popup')
+
+# Types a rule applies to when it doesn't list any.
+DEFAULT_TYPES = 0
+for name in TYPE_OPT_IDS:
+    if name not in PAGE_TYPES:
+        DEFAULT_TYPES |= TYPE_BITS[name]
+
+# Option bits.
+OPT_THIRD_PARTY = 1
+OPT_FIRST_PARTY = 2
+OPT_MATCH_CASE = 4
+
+# Options Adblock Plus accepts but which have no effect.
+IGNORED_OPTS = ('collapse', 'donottrack')
+
+# Bump this whenever the layout of pickled Filter objects changes, so that
+# stale snapshots are discarded.
+FORMAT_VERSION = 9
+
+# Rules with the same options share one options tuple, and rules listing the
+# same domains share one set, since EasyList repeats them thousands of times.
+# Both survive pickling, which keeps one copy of each shared object.
+_option_tables = {}
+_domain_sets = {}
+
+def _shared_domains(domains):
+    if not domains:
+        return None
+    domains = frozenset(sys.intern(domain) for domain in domains)
+    return _domain_sets.setdefault(domains, domains)
+
+# Options of rules without an option string.
+DEFAULT_OPTIONS = (DEFAULT_TYPES, 0, None, None)
+
+# Rules are kept compact, since a full EasyList and EasyPrivacy load creates
+# tens of thousands of them and most are never used. Only the rule string
+# is stored; the pattern and option string are sliced out of it when
+# needed, and the options live in a shared (type mask, option bits,
+# domains, excluded domains) tuple. source is the name of the list the rule
+# came from, interned, or None.
 class Rule(object):
-    def __init__(self, rule_str):
+    __slots__ = ('rule_str', 'is_exception', 'opts', 'source', '_regex')
+
+    def __init__(self, rule_str, source=None):
         self.rule_str = rule_str.strip()
-        if '$' in rule_str:
-            try:
-                self.pattern, self.optstring = rule_str.split('$')
-            except ValueError:
-                raise RuleSyntaxError()
+        self.source = source
+        self.is_exception = self.rule_str.startswith('@@')
+        self._regex = None
+        if '$' in self.rule_str:
+            self.opts = self._parse_options()
         else:
-            self.pattern = self.rule_str
-            self.optstring = ''
-        self.regex = self._to_regex()
-        opts = self.optstring.split(',')
-        self.excluded_elements = []
-        self.matched_elements = []
-        for o in opts:
-            if o.startswith('~') and o[1:] in TYPE_OPT_IDS:
-                self.excluded_elements.append(o)
-            elif o in TYPE_OPT_IDS:
-                self.matched_elements.append(o)
-        if self.matched_elements == []:
-            self.matched_elements = TYPE_OPT_IDS
+            self.opts = DEFAULT_OPTIONS
+
+    def _split(self):
+        pattern = self.rule_str[2:] if self.is_exception else self.rule_str
+        if '$' in pattern:
+            return pattern.rsplit('$', 1)
+        return pattern, ''
+
+    @property
+    def pattern(self):
+        return self._split()[0]
+
+    @property
+    def optstring(self):
+        return self._split()[1]
+
+    @property
+    def type_mask(self):
+        return self.opts[0]
+
+    @property
+    def options(self):
+        return self.opts[1]
+
+    @property
+    def domains(self):
+        return self.opts[2]
+
+    @property
+    def excluded_domains(self):
+        return self.opts[3]
+
+    # Compiles the option string into bitmasks and domain sets.
+    def _parse_options(self):
+        type_mask = 0
+        options = 0
+        domains = None
+        excluded_domains = None
+        excluded_types = 0
+        for o in self.optstring.split(','):
+            o = o.strip().lower()
+            if not o:
+                continue
+            inverse = o.startswith('~')
+            name = o[1:] if inverse else o
+            if name in TYPE_BITS:
+                if inverse:
+                    excluded_types |= TYPE_BITS[name]
+                else:
+                    type_mask |= TYPE_BITS[name]
+            elif name == 'third-party':
+                options |= OPT_FIRST_PARTY if inverse else OPT_THIRD_PARTY
+            elif name == 'match-case':
+                options |= OPT_MATCH_CASE
+            elif name.startswith('domain='):
+                included = set()
+                excluded = set()
+                for domain in name[7:].split('|'):
+                    if domain.startswith('~'):
+                        excluded.add(domain[1:])
+                    elif domain:
+                        included.add(domain)
+                domains = _shared_domains(included)
+                excluded_domains = _shared_domains(excluded)
+            elif name in IGNORED_OPTS:
+                continue
+            else:
+                # Unknown options, and ones like csp and rewrite that Nimbus
+                # doesn't support, make the rule invalid, as in Adblock
+                # Plus; ignoring them would make it apply more widely.
+                raise RuleSyntaxError(name)
+        if not type_mask:
+            type_mask = DEFAULT_TYPES
+        opts = (type_mask & ~excluded_types, options, domains, excluded_domains)
+        return _option_tables.setdefault(opts, opts)
+
+    # The regex is compiled on first use, so that rules loaded from a
+    # snapshot don't pay for it up front.
+    @property
+    def regex(self):
+        if self._regex is None:
+            self._regex = self._to_regex()
+        return self._regex
+
+    def __getstate__(self):
+        return (self.rule_str, self.is_exception, self.opts, self.source)
+
+    def __setstate__(self, state):
+        self.rule_str, self.is_exception, self.opts, self.source = state
+        self._regex = None
 
     def get_tokens(self):
         return RE_TOK.split(self.pattern)
 
-    def match(self, url, elementtype=None):
-        if elementtype:
-            if elementtype in self.excluded_elements or\
-                    (elementtype not in self.matched_elements and\
-                         'other' not in self.matched_elements):
+    def is_regex(self):
+        pattern = self.pattern
+        return len(pattern) > 1 and pattern.startswith('/') and\
+               pattern.endswith('/')
+
+    # Returns the literal fragments of the pattern, which must appear in
+    # any URL the rule matches.
+    def get_literals(self):
+        pattern = self.pattern
+        if len(pattern) > 1 and pattern.startswith('/') and pattern.endswith('/'):
+            return []
+        return [lit.lower() for lit in RE_LITERAL.split(pattern) if lit]
+
+    # Returns the strings this rule could be indexed under: the words in
+    # its literal fragments or, failing that, the fragments themselves.
+    def get_keywords(self):
+        literals = self.get_literals()
+        keywords = [tok[:KEYWORD_MAX_LENGTH] for lit in literals
+                    for tok in RE_TOK.split(lit) if len(tok) >= KEYWORD_MIN_LENGTH]
+        if not keywords:
+            keywords = [lit[:KEYWORD_MAX_LENGTH] for lit in literals
+                        if len(lit) >= KEYWORD_MIN_LENGTH]
+        return keywords
+
+    # Returns the host this rule blocks if it is a plain ||example.com^
+    # rule, or None otherwise.
+    def get_host(self):
+        m = RE_HOST_RULE.match(self.pattern.lower())
+        if m:
+            return m.group(1)
+        return None
+
+    # Checks a request against the rule's options. types is a mask of
+    # TYPE_BITS, party is OPT_THIRD_PARTY, OPT_FIRST_PARTY or 0 if unknown,
+    # and domain is the host of the document making the request.
+    def match_options(self, types=DEFAULT_TYPES, party=0, domain=None):
+        type_mask, options, domains, excluded_domains = self.opts
+        if not type_mask & types:
+            return False
+        if party and options & (OPT_THIRD_PARTY | OPT_FIRST_PARTY) and\
+                not options & party:
+            return False
+        if domains is not None or excluded_domains is not None:
+            return self.match_domain(domain)
+        return True
+
+    # Rules restricted to some domains don't apply when the domain is
+    # unknown. Otherwise the most specific listed domain decides.
+    def match_domain(self, domain):
+        domains, excluded_domains = self.opts[2:]
+        if domain is None:
+            return domains is None
+        while domain:
+            if excluded_domains is not None and domain in excluded_domains:
                 return False
+            if domains is not None and domain in domains:
+                return True
+            dot = domain.find('.')
+            if dot < 0:
+                break
+            domain = domain[dot+1:]
+        return domains is None
+
+    def match(self, url, elementtype=None, domain=None, thirdparty=None):
+        if not self.match_options(request_types(elementtype),
+                                  request_party(thirdparty), domain):
+            return False
         return self.regex.search(url)
 
     def _to_regex(self):
-        re_str = re.escape(self.pattern)
-        for m in MAP_RE:
-            re_str = re_str.replace(*m)
-        return re.compile(re_str)
+        flags = 0 if self.opts[1] & OPT_MATCH_CASE else re.IGNORECASE
+        pattern = self.pattern
+        if self.is_regex():
+            return re.compile(pattern[1:-1], flags)
+        prefix = ''
+        suffix = ''
+        if pattern.startswith('||'):
+            prefix = RE_HOST_ANCHOR
+            pattern = pattern[2:]
+        elif pattern.startswith('|'):
+            prefix = '^'
+            pattern = pattern[1:]
+        if pattern.endswith('|'):
+            suffix = '$'
+            pattern = pattern[:-1]
+        re_str = ''.join('.*' if ch == '*' else RE_SEPARATOR if ch == '^'
+                         else re.escape(ch) for ch in pattern)
+        return re.compile(prefix + re_str + suffix, flags)
     
     def __unicode__(self):
         return self.rule_str
 
 
-class Filter(object):
-    def __init__(self, f):
+# Converts an element type name into a mask of TYPE_BITS. Unknown requests
+# may be of any of the default types.
+def request_types(elementtype=None):
+    if elementtype:
+        return TYPE_BITS.get(elementtype, TYPE_BITS['other'])
+    return DEFAULT_TYPES
+
+def request_party(thirdparty=None):
+    if thirdparty is None:
+        return 0
+    return OPT_THIRD_PARTY if thirdparty else OPT_FIRST_PARTY
+
+
+# Returns the lowercased host name of a URL, without credentials or port.
+def get_host(url):
+    start = url.find('://')
+    if start < 0:
+        return ''
+    start += 3
+    end = len(url)
+    for sep in '/?#':
+        i = url.find(sep, start, end)
+        if i >= 0:
+            end = i
+    host = url[start:end]
+    if '@' in host:
+        host = host.rsplit('@', 1)[1]
+    if host.startswith('['): # IPv6 literal
+        return host.split(']', 1)[0][1:].lower()
+    return host.split(':', 1)[0].lower()
+
+
+# Returns the registrable part of a host name, e.g. example.co.uk for
+# www.example.co.uk. This is a heuristic, not the Public Suffix List.
+def base_domain(host):
+    labels = host.rstrip('.').split('.')
+    if len(labels) > 2 and len(labels[-1]) == 2 and len(labels[-2]) <= 3:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+# Returns whether a request to host made by a document on domain is a
+# third-party request.
+def is_third_party(host, domain):
+    return base_domain(host.lower()) != base_domain(domain.lower())
+
+
+# Names that hosts files map to localhost for their own sake, rather than
+# to block them.
+LOCAL_HOSTS = frozenset(('localhost', 'localhost.localdomain', 'local',
+                         'broadcasthost', 'ip6-localhost', 'ip6-loopback',
+                         '0.0.0.0', '127.0.0.1'))
+
+# Blocked hosts, as read from hosts files, mapped to the name of the file
+# they came from (or None). A host is blocked if it or any of its parent
+# domains is in the table, so lookups cost one probe per label.
+class HostFilter(object):
+    def __init__(self, hosts=()):
+        self.hosts = {}
+        for host in hosts:
+            self.add(host)
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def __contains__(self, host):
+        return self.match(host) is not None
+
+    def add(self, host, source=None):
+        host = host.strip().rstrip('.').lower()
+        if host and host not in LOCAL_HOSTS and host not in self.hosts:
+            self.hosts[host] = source
+
+    # Adds the host names on one line of a hosts file. Lines are either
+    # "address host [host...]" or just a host name.
+    def add_line(self, line, source=None):
+        line = line.split('#', 1)[0]
+        fields = line.split()
+        if len(fields) > 1:
+            fields = fields[1:]
+        for host in fields:
+            self.add(host, source)
+
+    def add_lines(self, lines, source=None):
+        if source is not None:
+            source = sys.intern(source)
+        for line in lines:
+            self.add_line(line, source)
+
+    # Returns the name of the file a blocked entry came from.
+    def source(self, host):
+        return self.hosts.get(host)
+
+    # Returns the blocked entry that matches host, or None. Ports are
+    # ignored.
+    def match(self, host):
+        hosts = self.hosts
+        host = host.split(':', 1)[0].rstrip('.').lower()
+        while host:
+            if host in hosts:
+                return host
+            dot = host.find('.')
+            if dot < 0:
+                break
+            host = host[dot+1:]
+
+
+# Aho-Corasick automaton over the rule keywords. Transitions are kept in a
+# single flat dictionary keyed by (state, character) instead of one
+# dictionary per state, which keeps it small enough for EasyList.
+class Automaton(object):
+    def __init__(self, keywords=()):
+        self.goto = {}
+        self.fail = [0]
+        self.link = [0]
+        self.out = [None]
+        for keyword in keywords:
+            self.add(keyword)
+        self.build()
+
+    def add(self, keyword):
+        goto = self.goto
+        state = 0
+        for ch in keyword:
+            key = (state, ch)
+            if key in goto:
+                state = goto[key]
+            else:
+                goto[key] = state = len(self.out)
+                self.fail.append(0)
+                self.link.append(0)
+                self.out.append(None)
+        self.out[state] = keyword
+
+    # Computes failure and output links breadth-first.
+    def build(self):
+        goto = self.goto
+        fail = self.fail
+        link = self.link
+        out = self.out
+        children = {}
+        for (state, ch), child in goto.items():
+            if state not in children:
+                children[state] = []
+            children[state].append((ch, child))
+        queue = [child for ch, child in children.get(0, ())]
+        for state in queue:
+            for ch, child in children.get(state, ()):
+                f = fail[state]
+                while f and (f, ch) not in goto:
+                    f = fail[f]
+                f = goto.get((f, ch), 0)
+                fail[child] = f
+                link[child] = f if out[f] is not None else link[f]
+                queue.append(child)
+
+    # Yields every keyword occurring in text, scanning it only once.
+    def search(self, text):
+        goto = self.goto
+        fail = self.fail
+        link = self.link
+        out = self.out
+        state = 0
+        for ch in text:
+            while state and (state, ch) not in goto:
+                state = fail[state]
+            state = goto.get((state, ch), 0)
+            s = state if out[state] is not None else link[state]
+            while s:
+                yield out[s]
+                s = link[s]
+
+
+# Builds a stylesheet that hides every element matched by selectors. Each
+# selector gets a rule of its own, so that one the browser doesn't
+# understand doesn't take the others down with it.
+def hiding_stylesheet(selectors):
+    return ''.join('%s { display: none !important; }\n' % (selector,)
+                   for selector in selectors)
+
+
+# Index of either blocking or exception rules. Plain ||example.com^ rules
+# go into a table keyed by host; every other rule is indexed under one of
+# its keywords, and the keywords are compiled into an automaton. Rules with
+# no keyword are kept in a list that is checked on every request.
+class RuleIndex(object):
+    def __init__(self, rules=()):
         self.index = {}
-        for rul in f:
-            if rul.startswith('!'): # Comment 
-                continue 
-            if '##' in rul: # HTML rule
+        # Host-anchored rules, keyed by the host they block.
+        self.hosts = {}
+        # Regex rules and rules without a usable literal fragment, such as
+        # $script,domain=example.com.
+        self.unindexed = []
+        # Number of rules, counted once here, since match() tests the
+        # index for emptiness on every request.
+        self.rule_count = 0
+        candidates = []
+        frequency = {}
+        for rule in rules:
+            self.rule_count += 1
+            host = rule.get_host()
+            if host is not None:
+                if host not in self.hosts:
+                    self.hosts[host] = []
+                self.hosts[host].append(rule)
                 continue
-            try:
-                rule = Rule(rul)
-            except RuleSyntaxError:
-                print('syntax error in ', rul)
-            for tok in rule.get_tokens():
-                if len(tok) > 2:
-                    if tok not in self.index:
-                        self.index[tok] = []
-                    self.index[tok].append(rule)
-
-    def match(self, url, elementtype=None):
-        tokens = RE_TOK.split(url)
-        for tok in tokens:
-            if len(tok) > 2:
-                if tok in self.index:
-                    for rule in self.index[tok]:
-                        if rule.match(url, elementtype=elementtype):
+            keywords = rule.get_keywords()
+            if not keywords:
+                self.unindexed.append(rule)
+                continue
+            candidates.append((rule, keywords))
+            for keyword in set(keywords):
+                frequency[keyword] = frequency.get(keyword, 0) + 1
+        # Each rule is indexed under a single keyword: the one shared by the
+        # fewest other rules, preferring longer ones on ties.
+        for rule, keywords in candidates:
+            keyword = min(keywords, key=lambda k: (frequency[k], -len(k)))
+            if keyword not in self.index:
+                self.index[keyword] = []
+            self.index[keyword].append(rule)
+        self.automaton = Automaton(self.index.keys())
+
+    def __len__(self):
+        return self.rule_count
+
+    # Option checks are done first, since they are only bit operations and
+    # set lookups; the regex only runs for rules that pass them.
+    def match(self, url, lurl, host, types, party, domain):
+        hosts = self.hosts
+        if hosts:
+            h = host
+            while h:
+                if h in hosts:
+                    for rule in hosts[h]:
+                        if rule.match_options(types, party, domain):
                             return rule
+                dot = h.find('.')
+                if dot < 0:
+                    break
+                h = h[dot+1:]
+        index = self.index
+        for keyword in self.automaton.search(lurl):
+            for rule in index[keyword]:
+                if rule.match_options(types, party, domain) and\
+                        rule.regex.search(url):
+                    return rule
+        for rule in self.unindexed:
+            if rule.match_options(types, party, domain) and\
+                    rule.regex.search(url):
+                return rule
+
+
+# Parses the lines of an Adblock Plus list. Returns the network rules and
+# the element hiding rules, which are kept as strings. source is the name
+# of the list, which the rules remember.
+def parse_rules(lines, source=None):
+    if source is not None:
+        source = sys.intern(source)
+    rules = {}
+    hiding = []
+    for rul in lines:
+        rul = rul.strip()
+        if not rul or rul in rules:
+            continue
+        if rul.startswith('!') or rul.startswith('['): # Comment or header
+            continue 
+        if '##' in rul or '#@#' in rul: # HTML rule
+            hiding.append(rul)
+            continue
+        try:
+            rules[rul] = Rule(rul, source)
+        except RuleSyntaxError:
+            pass
+    return list(rules.values()), hiding
+
+# Parses one list file. This and build_filter are meant to be run in worker
+# processes, one list per process.
+def parse_file(path):
+    f = open(path, encoding='utf-8', errors='replace')
+    try:
+        return parse_rules(f, os.path.basename(path))
+    finally:
+        f.close()
+
+# Builds a Filter from the output of parse_rules for several lists and
+# returns it pickled, ready to be sent back to the browser.
+def build_filter(parsed):
+    return pickle.dumps(Filter(parsed=parsed), pickle.HIGHEST_PROTOCOL)
+
+
+class Filter(object):
+    # f is an iterable of rule lines; parsed is a list of parse_rules
+    # results, for lists that have already been parsed.
+    def __init__(self, f=(), parsed=()):
+        # Element hiding selectors that apply everywhere, selectors keyed by
+        # the domain they apply to, and selectors excluded on a domain ('' for
+        # everywhere).
+        self.hiding_generic = []
+        self.hiding_domains = {}
+        self.hiding_exceptions = {}
+        parsed = list(parsed)
+        if f:
+            parsed.append(parse_rules(f))
+        # Identical rules from different lists are only kept once.
+        rules = {}
+        for network_rules, hiding_rules in parsed:
+            for rule in network_rules:
+                if rule.rule_str not in rules:
+                    rules[rule.rule_str] = rule
+            for rul in hiding_rules:
+                self._add_hiding_rule(rul)
+        self.blocking = RuleIndex(rule for rule in rules.values()
+                                  if not rule.is_exception)
+        self.exceptions = RuleIndex(rule for rule in rules.values()
+                                    if rule.is_exception)
+        excluded = self.hiding_exceptions.get('', ())
+        self.hiding_generic = [selector for selector in
+                               dict.fromkeys(self.hiding_generic)
+                               if selector not in excluded]
+
+    # Adds an element hiding rule: [domain,~domain,...]##selector, or #@#
+    # for an exception.
+    def _add_hiding_rule(self, rul):
+        exception = '#@#' in rul
+        domains, selector = rul.split('#@#' if exception else '##', 1)
+        selector = selector.strip()
+        # Skip extended syntaxes and anything that could escape its rule.
+        if not selector or selector.startswith('+js(') or\
+                selector.startswith('^') or ':-abp-' in selector or\
+                '{' in selector or '}' in selector or\
+                domains.endswith('#?') or domains.endswith('#$'):
+            return
+        included = []
+        excluded = []
+        for domain in domains.lower().split(','):
+            domain = domain.strip()
+            if domain.startswith('~'):
+                excluded.append(domain[1:])
+            elif domain:
+                included.append(domain)
+        if exception:
+            for domain in included or ['']:
+                self.hiding_exceptions.setdefault(domain, set()).add(selector)
+            return
+        for domain in excluded:
+            self.hiding_exceptions.setdefault(domain, set()).add(selector)
+        if included:
+            for domain in included:
+                self.hiding_domains.setdefault(domain, []).append(selector)
+        else:
+            self.hiding_generic.append(selector)
+
+    # Counts network rules and element hiding selectors.
+    def __len__(self):
+        return len(self.blocking) + len(self.exceptions) +\
+               len(self.hiding_generic) + self.hiding_count()
+
+    # Counts the domain-specific element hiding selectors.
+    def hiding_count(self):
+        return sum(len(selectors) for selectors in self.hiding_domains.values())
+
+    # Returns whether any element hiding rule is specific to domain or one
+    # of its parent domains. If not, only the generic selectors apply.
+    def has_hiding_rules(self, domain):
+        while domain:
+            if domain in self.hiding_domains or domain in self.hiding_exceptions:
+                return True
+            dot = domain.find('.')
+            if dot < 0:
+                break
+            domain = domain[dot+1:]
+        return False
+
+    # Returns the element hiding selectors specific to domain and its parent
+    # domains, and the set of selectors that are excluded on it.
+    def get_domain_hiding_selectors(self, domain):
+        specific = []
+        excluded = set()
+        while domain:
+            specific += self.hiding_domains.get(domain, ())
+            excluded.update(self.hiding_exceptions.get(domain, ()))
+            dot = domain.find('.')
+            if dot < 0:
+                break
+            domain = domain[dot+1:]
+        if excluded:
+            specific = [selector for selector in specific
+                        if selector not in excluded]
+        return specific, excluded
+
+    # Returns the element hiding selectors that apply on domain.
+    def get_hiding_selectors(self, domain):
+        specific, excluded = self.get_domain_hiding_selectors(domain)
+        if not excluded:
+            return self.hiding_generic + specific
+        return [selector for selector in self.hiding_generic
+                if selector not in excluded] + specific
+
+    # Returns the blocking rule that matches a request, or None if no rule
+    # does or if an exception rule allows it. domain is the host of the
+    # document making the request, and thirdparty says whether the request
+    # goes to a different site.
+    def match(self, url, elementtype=None, domain=None, thirdparty=None):
+        lurl = url.lower()
+        host = get_host(lurl)
+        types = request_types(elementtype)
+        party = request_party(thirdparty)
+        rule = self.blocking.match(url, lurl, host, types, party, domain)
+        if rule is not None and self.exceptions and\
+                self.exceptions.match(url, lurl, host, types, party, domain):
+            return None
+        return rule
+
+    # Returns whether an exception rule with the document option, or with
+    # elementtype (e.g. elemhide), allows everything on the page at url.
+    def is_whitelisted(self, url, elementtype='document'):
+        if not self.exceptions:
+            return False
+        lurl = url.lower()
+        host = get_host(lurl)
+        types = TYPE_BITS['document'] | TYPE_BITS[elementtype]
+        return self.exceptions.match(url, lurl, host, types, 0, host) is not None
 
 
 if __name__ == '__main__':
-    f = Filter(file('easylist.txt'))
+    f = Filter(open('easylist.txt', encoding='utf-8', errors='replace'))
     print('start matching')
-    f.match(sys.argv[1])
+    print(f.match(sys.argv[1]))
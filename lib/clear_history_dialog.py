@@ -46,6 +46,7 @@ class ClearHistoryDialog(QDialog):
         self.dataType.addItem(tr("History"))
         self.dataType.addItem(tr("Cookies"))
         self.dataType.addItem(tr("Memory Caches"))
+        self.dataType.addItem(tr("Disk Cache"))
         self.dataType.addItem(tr("Persistent Storage"))
         self.dataType.addItem(tr("Everything"))
         self.layout.addWidget(self.dataType)
@@ -69,11 +70,14 @@ class ClearHistoryDialog(QDialog):
         clear_everything = (self.dataType.currentIndex() == self.dataType.count()-1)
         if self.dataType.currentIndex() == 0 or clear_everything:
             data.clearHistory()
+            network.request_journal.clear()
         if self.dataType.currentIndex() == 1 or clear_everything:
             data.clearCookies()
         if self.dataType.currentIndex() == 2 or clear_everything:
             QWebSettings.globalSettings().clearMemoryCaches()
         if self.dataType.currentIndex() == 3 or clear_everything:
+            network.clear_cache()
+        if self.dataType.currentIndex() == 4 or clear_everything:
             QWebSettings.globalSettings().setIconDatabasePath("")
             QWebSettings.globalSettings().setLocalStoragePath("")
             QWebSettings.globalSettings().setOfflineStoragePath("")
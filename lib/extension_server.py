@@ -11,15 +11,123 @@
 
 # Import whatever we need to run.
 import os
-from http.server import SimpleHTTPRequestHandler
-import http.server
-import time
+import io
+import gzip
+import threading
+import email.utils
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 try:
     from PyQt5.QtCore import QThread
 except ImportError:
     from PyQt4.QtCore import QThread
 from settings import extensions_folder
 
+# The port extensions expect the server on. If it is taken, the server
+# runs on a free port instead, and network.py redirects requests for this
+# one to it.
+default_port = 8133
+
+# The port the server is actually running on, once it has started.
+port = None
+
+# Types of files that are worth compressing.
+compressible_types = ("text/", "application/javascript", "application/json",
+                      "application/xml", "image/svg+xml")
+
+# Compressed copies of text files, keyed by path, modification time and
+# size, so that each file is only compressed once.
+gzip_cache = {}
+gzip_cache_lock = threading.Lock()
+
+def gzipped(path, key):
+    with gzip_cache_lock:
+        try: return gzip_cache[path, key]
+        except KeyError: pass
+    f = open(path, "rb")
+    try: content = gzip.compress(f.read())
+    finally: f.close()
+    with gzip_cache_lock:
+        for old_key in [k for k in gzip_cache if k[0] == path]:
+            del gzip_cache[old_key]
+        gzip_cache[path, key] = content
+    return content
+
+# Request handler with persistent connections, ETag and Last-Modified
+# validation and gzip compression of text files.
+class ExtensionRequestHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            index = os.path.join(path, "index.html")
+            if not os.path.isfile(index):
+                # Directory listings and redirects are left to the base class.
+                return SimpleHTTPRequestHandler.send_head(self)
+            if not self.path.split("?", 1)[0].split("#", 1)[0].endswith("/"):
+                return SimpleHTTPRequestHandler.send_head(self)
+            path = index
+        try: stat = os.stat(path)
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+        key = (stat.st_mtime_ns, stat.st_size)
+        last_modified = self.date_time_string(int(stat.st_mtime))
+        ctype = self.guess_type(path)
+        # The compressed and uncompressed files are different bytes, so
+        # they get different validators.
+        use_gzip = ctype.startswith(compressible_types) and "gzip" in self.headers.get("Accept-Encoding", "")
+        etag = "\"%x-%x%s\"" % (key + ("-gz" if use_gzip else "",))
+
+        not_modified = False
+        if "If-None-Match" in self.headers:
+            not_modified = etag in [tag.strip() for tag in self.headers["If-None-Match"].split(",")] or\
+                           self.headers["If-None-Match"].strip() == "*"
+        elif "If-Modified-Since" in self.headers:
+            try: since = email.utils.parsedate_to_datetime(self.headers["If-Modified-Since"])
+            except: since = None
+            if since is not None:
+                not_modified = int(stat.st_mtime) <= since.timestamp()
+        if not_modified:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.end_headers()
+            return None
+
+        encoding = None
+        if use_gzip:
+            try:
+                f = io.BytesIO(gzipped(path, key))
+                encoding = "gzip"
+            except OSError:
+                etag = "\"%x-%x\"" % key
+        if encoding is None:
+            try: f = open(path, "rb")
+            except OSError:
+                self.send_error(404, "File not found")
+                return None
+        length = len(f.getvalue()) if encoding else stat.st_size
+
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(length))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.send_header("Cache-Control", "no-cache")
+        if ctype.startswith(compressible_types):
+            self.send_header("Vary", "Accept-Encoding")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        return f
+
+class ExtensionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
 class ExtensionServerThread(QThread):
     def __init__(self, *args, directory=extensions_folder, **kwargs):
         super(ExtensionServerThread, self).__init__(*args, **kwargs)
@@ -27,27 +135,22 @@ class ExtensionServerThread(QThread):
         self.httpd = None
     def setDirectory(self, directory):
         self.directory = directory
-        os.chdir(self.directory)
+    # Handlers are given the folder explicitly instead of serving from the
+    # working directory.
+    def makeHandler(self, *args, **kwargs):
+        return ExtensionRequestHandler(*args, directory=self.directory, **kwargs)
     def run(self):
-        os.chdir(self.directory)
-        HandlerClass = SimpleHTTPRequestHandler
-        ServerClass  = http.server.HTTPServer
-        Protocol     = "HTTP/1.0"
-
-        port = 8133
-        server_address = ('127.0.0.1', port)
-
-        HandlerClass.protocol_version = Protocol
-        counter = 5
-        while 1:
-            try: self.httpd = ServerClass(server_address, HandlerClass)
-            except:
-                print("Failed to start extension server! Retrying in %s seconds." % (counter,))
-                time.sleep(counter)
-                counter *= 2
+        global port
+        for address in (("127.0.0.1", default_port), ("127.0.0.1", 0)):
+            try: self.httpd = ExtensionServer(address, self.makeHandler)
+            except OSError:
+                print("Port %s is not available for the extension server." % (address[1],))
             else:
-                print("Extension server started successfully.")
                 break
-
-        sa = self.httpd.socket.getsockname()
+        if self.httpd is None:
+            print("Failed to start extension server!")
+            return
+        port = self.httpd.server_address[1]
+        print("Extension server started successfully on port %s." % (port,))
         self.httpd.serve_forever()
+        self.httpd.server_close()
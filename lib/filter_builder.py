@@ -0,0 +1,46 @@
+#! /usr/bin/env python3
+
+# -----------------
+# filter_builder.py
+# -----------------
+# Author:      Daniel Sim (foxhead128)
+# License:     See LICENSE.md for more details.
+# Description: Builds a compiled ad-block filter outside of the browser.
+#              filtering.py runs this as a script with the output file and
+#              the lists as arguments. It imports nothing but abpy, so the
+#              worker processes it spawns don't load Qt or touch the
+#              settings.
+
+import os
+import sys
+import multiprocessing
+import concurrent.futures
+import abpy
+
+# Parses each list in its own process, then builds the filter in one more,
+# and returns it pickled.
+def build(fnames):
+    context = multiprocessing.get_context("spawn")
+    workers = max(1, min(len(fnames), os.cpu_count() or 1))
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    try:
+        parsed = list(pool.map(abpy.parse_file, fnames))
+        return pool.submit(abpy.build_filter, parsed).result()
+    finally:
+        pool.shutdown()
+
+def main(argv):
+    if len(argv) < 2:
+        print("Usage: %s output [list ...]" % (os.path.basename(argv[0]),), file=sys.stderr)
+        return 2
+    output = argv[1]
+    data = build(argv[2:])
+    temp_file = output + ".part"
+    f = open(temp_file, "wb")
+    try: f.write(data)
+    finally: f.close()
+    os.replace(temp_file, output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
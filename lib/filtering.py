@@ -7,31 +7,331 @@
 # License:     See LICENSE.md for more details.
 # Description: Loads URL filtering rules to be used by network.py.
 
+import sys
 import os.path
+import time
+import html
+import mmap
+import json
+import shutil
+import subprocess
+import tempfile
+import threading
+import concurrent.futures
+import pickle
+import hashlib
+import collections
 import abpy
 import paths
 import settings
 import traceback
 import urllib.request
+import urllib.error
 try:
-    from PyQt5.QtCore import QThread, QCoreApplication
+    from PyQt5.QtCore import QThread, QCoreApplication, QUrl
 except ImportError:
-    from PyQt4.QtCore import QThread, QCoreApplication
-
-# Dummy adblock filter class.
-class Filter(object):
-    def __init__(self, rules):
-        super(Filter, self).__init__()
-        self.index = {}
-    def match(self, url):
-        return None
+    from PyQt4.QtCore import QThread, QCoreApplication, QUrl
 
 # Global stuff.
 adblock_folder = os.path.join(settings.settings_folder, "Adblock")
 hosts_folder = os.path.join(settings.settings_folder, "Hosts")
-adblock_filter = Filter([])
+adblock_filter = abpy.Filter([])
 shelved_filter = None
-adblock_rules = []
+
+# Compiled adblock filter, stored next to the lists so that it doesn't have
+# to be rebuilt on every launch.
+adblock_snapshot = os.path.join(settings.settings_folder, "Adblock.pkl")
+
+# Script that builds the compiled filter in a separate process, and how
+# many seconds it gets before it is given up on.
+filter_builder = os.path.join(paths.app_folder, "filter_builder.py")
+filter_builder_timeout = 300
+
+# Held while the adblock filter is being loaded or built, so that only one
+# build runs at a time and the last one to finish is always made from the
+# current lists.
+adblock_lock = threading.Lock()
+
+# This is bumped every time adblock_filter or host_rules is replaced, so
+# that cached verdicts made with the old rules are thrown out.
+generation = 0
+
+def filters_changed():
+    global generation
+    generation += 1
+
+# Bounded LRU cache of filter verdicts, keyed by URL and request type.
+class VerdictCache(object):
+    def __init__(self, size=4096):
+        super(VerdictCache, self).__init__()
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.generation = generation
+        self.hits = 0
+        self.misses = 0
+    def clear(self):
+        self.entries.clear()
+        self.generation = generation
+    def get(self, key):
+        if self.generation != generation:
+            self.clear()
+        try: verdict = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return verdict
+    def set(self, key, verdict):
+        if self.size < 1:
+            return
+        if self.generation != generation:
+            self.clear()
+        self.entries[key] = verdict
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+    def stats(self):
+        return {"size": len(self.entries), "maximum": self.size, "hits": self.hits, "misses": self.misses}
+
+verdict_cache = VerdictCache(settings.setting_to_int("content/FilterCacheSize"))
+
+# Checks a request against the adblock filter and the hosts list. Returns
+# the matching adblock rule and hosts entry, either of which may be None.
+# document_url is the URL of the page that made the request.
+def check_request(url, elementtype=None, document_url=None, host_filter=True):
+    host = abpy.get_host(url)
+    domain = abpy.get_host(document_url) if document_url else None
+    key = (url, elementtype, domain, host_filter)
+    verdict = verdict_cache.get(key)
+    if verdict is None:
+        thirdparty = abpy.is_third_party(host, domain) if host and domain else None
+        if statistics is not None:
+            verdict = statistics.match(url, elementtype, domain, thirdparty, host if host_filter else None)
+        else:
+            rule = adblock_filter.match(url, elementtype, domain, thirdparty)
+            host_entry = host_rules.match(host) if host_filter and host else None
+            verdict = (rule, host_entry)
+        verdict_cache.set(key, verdict)
+    rule, host_entry = verdict
+    if rule is not None and document_url and is_whitelisted(document_url):
+        rule = None
+    if statistics is not None:
+        statistics.count(rule, host_entry)
+    return rule, host_entry
+
+# Returns whether a page is whitelisted by a $document exception rule.
+def is_whitelisted(document_url):
+    key = (document_url, "document")
+    whitelisted = verdict_cache.get(key)
+    if whitelisted is None:
+        whitelisted = adblock_filter.is_whitelisted(document_url)
+        verdict_cache.set(key, whitelisted)
+    return whitelisted
+
+# Filter statistics: how often each rule and hosts entry fires and how long
+# matching takes. They are only collected while statistics is set, so that
+# check_request costs nothing extra otherwise.
+class FilterStatistics(object):
+    def __init__(self):
+        super(FilterStatistics, self).__init__()
+        self.reset()
+    def reset(self):
+        self.started = time.time()
+        self.requests = 0
+        self.blocked = 0
+        self.matches = 0
+        self.adblock_time = 0.0
+        self.host_time = 0.0
+        # Match times in microseconds; bucket n counts times below 2**n.
+        self.histogram = [0] * 24
+        self.rule_hits = collections.Counter()
+        self.host_hits = collections.Counter()
+        # Names of the lists that the rules and hosts that fired came from.
+        self.rule_sources = {}
+        self.host_sources = {}
+    # Matches a request that wasn't in the verdict cache, timing it.
+    def match(self, url, elementtype, domain, thirdparty, host):
+        start = time.perf_counter()
+        rule = adblock_filter.match(url, elementtype, domain, thirdparty)
+        middle = time.perf_counter()
+        host_entry = host_rules.match(host) if host else None
+        end = time.perf_counter()
+        self.matches += 1
+        self.adblock_time += middle - start
+        self.host_time += end - middle
+        self.histogram[min(len(self.histogram) - 1, int((end - start) * 1000000).bit_length())] += 1
+        return rule, host_entry
+    # Counts the verdict for every request, cached or not.
+    def count(self, rule, host_entry):
+        self.requests += 1
+        if rule is not None:
+            self.rule_hits[rule.rule_str] += 1
+            self.rule_sources[rule.rule_str] = rule.source
+        if host_entry:
+            self.host_hits[host_entry] += 1
+            self.host_sources[host_entry] = host_rules.source(host_entry)
+        if rule is not None or host_entry:
+            self.blocked += 1
+    # Adds up the hits of each list, from the lists the rules and hosts
+    # that fired were loaded from.
+    def list_hits(self):
+        hits = collections.Counter()
+        for rule_str, count in self.rule_hits.items():
+            hits["Adblock/%s" % (self.rule_sources.get(rule_str),)] += count
+        for host, count in self.host_hits.items():
+            hits["Hosts/%s" % (self.host_sources.get(host),)] += count
+        return dict(hits)
+    def to_dict(self):
+        return {"since": self.started,
+                "requests": self.requests,
+                "blocked": self.blocked,
+                "matches": self.matches,
+                "adblock_time": self.adblock_time,
+                "host_time": self.host_time,
+                "histogram": dict(("<%dus" % (2 ** i), count) for i, count in enumerate(self.histogram) if count),
+                "verdict_cache": verdict_cache.stats(),
+                "rule_hits": dict(self.rule_hits),
+                "host_hits": dict(self.host_hits),
+                "list_hits": self.list_hits()}
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True)
+    def to_html(self, limit=100):
+        data = self.to_dict()
+        def table(heading, rows):
+            return "<h2>%s</h2><table>%s</table>" % (heading, "".join("<tr><td>%s</td><td>%s</td></tr>" % (html.escape(str(name)), value) for name, value in rows))
+        summary = (("Requests", data["requests"]),
+                   ("Blocked", data["blocked"]),
+                   ("Matched (not cached)", data["matches"]),
+                   ("Ad-block matching time", "%.3f s" % data["adblock_time"]),
+                   ("Host filter matching time", "%.3f s" % data["host_time"]),
+                   ("Verdict cache hits", data["verdict_cache"]["hits"]),
+                   ("Verdict cache misses", data["verdict_cache"]["misses"]))
+        histogram = [("&lt; %d &micro;s" % (2 ** i), count) for i, count in enumerate(self.histogram) if count]
+        return statistics_page % {"summary": table("Summary", summary),
+                                  "histogram": table("Match times", histogram),
+                                  "lists": table("Lists", sorted(data["list_hits"].items())),
+                                  "rules": table("Rules", self.rule_hits.most_common(limit)),
+                                  "hosts": table("Hosts", self.host_hits.most_common(limit))}
+
+statistics_page = """<!DOCTYPE html>
+<html>
+    <head>
+        <title>Filter Statistics</title>
+        <style type="text/css">html{font-family:sans-serif;}td{padding-right:2em;}</style>
+    </head>
+    <body>
+        <h1>Filter Statistics</h1>
+        <p><a href="nimbus:filterstats.json">JSON</a></p>
+        %(summary)s
+        %(histogram)s
+        %(lists)s
+        %(rules)s
+        %(hosts)s
+    </body>
+</html>
+"""
+
+statistics = None
+
+def enable_statistics(enabled=True):
+    global statistics
+    if not enabled:
+        statistics = None
+    elif statistics is None:
+        statistics = FilterStatistics()
+
+# Writes the statistics to a JSON file.
+def dump_statistics(fname=os.path.join(settings.settings_folder, "FilterStatistics.json")):
+    if statistics is None:
+        return
+    try:
+        f = open(fname, "w")
+        try: f.write(statistics.to_json())
+        finally: f.close()
+    except:
+        traceback.print_exc()
+
+# Element hiding.
+# Pages without element hiding rules of their own all share this
+# stylesheet, which imports user.css and holds the generic selectors.
+generic_stylesheet = os.path.join(settings.settings_folder, "ElementHiding.css")
+
+# Pages with rules of their own get a small stylesheet in this folder,
+# which imports the generic one and adds the rules for their domain. All
+# stylesheets import user.css rather than copy it, so that edits to it
+# show up without rebuilding them.
+domain_stylesheets = os.path.join(settings.settings_folder, "ElementHiding")
+domain_stylesheet_limit = 256
+stylesheet_key = None
+stylesheet_cache = collections.OrderedDict()
+generic_selectors = frozenset()
+
+def css_import(path):
+    return "@import url(\"%s\");\n" % (QUrl.fromLocalFile(path).toString(),)
+
+def write_stylesheet(path, css):
+    try:
+        f = open(path, "w")
+        try: f.write(css)
+        finally: f.close()
+    except:
+        traceback.print_exc()
+        return False
+    return True
+
+def clear_domain_stylesheets():
+    stylesheet_cache.clear()
+    try: shutil.rmtree(domain_stylesheets)
+    except: pass
+
+# Returns the URL of the user stylesheet for a page: user.css followed by
+# the element hiding rules that apply to the page's domain.
+def stylesheet_url(url):
+    global stylesheet_key
+    global generic_selectors
+    enabled = settings.typed.AdblockEnabled or settings.typed.HostFilterEnabled
+    key = (generation, enabled, tuple(settings.adremover_filters))
+    if key != stylesheet_key:
+        clear_domain_stylesheets()
+        css = css_import(settings.user_css)
+        if enabled:
+            css += abpy.hiding_stylesheet(adblock_filter.hiding_generic + settings.adremover_filters)
+        write_stylesheet(generic_stylesheet, css)
+        generic_selectors = frozenset(adblock_filter.hiding_generic)
+        stylesheet_key = key
+    if not enabled or adblock_filter.is_whitelisted(url, "elemhide"):
+        return QUrl.fromLocalFile(settings.user_css).toString()
+    domain = abpy.get_host(url)
+    generichide = adblock_filter.is_whitelisted(url, "generichide")
+    if not generichide and not adblock_filter.has_hiding_rules(domain):
+        return QUrl.fromLocalFile(generic_stylesheet).toString()
+    cache_key = (domain, generichide)
+    try:
+        stylesheet_cache.move_to_end(cache_key)
+        return stylesheet_cache[cache_key]
+    except KeyError:
+        pass
+    specific, excluded = adblock_filter.get_domain_hiding_selectors(domain)
+    if generichide:
+        css = css_import(settings.user_css) + abpy.hiding_stylesheet(specific + settings.adremover_filters)
+    elif generic_selectors.isdisjoint(excluded):
+        css = css_import(generic_stylesheet) + abpy.hiding_stylesheet(specific)
+    else:
+        # Generic selectors that are excluded here can't be taken back by
+        # a stylesheet that imports them, so this page gets a full copy.
+        css = css_import(settings.user_css) + abpy.hiding_stylesheet(adblock_filter.get_hiding_selectors(domain) + settings.adremover_filters)
+    fname = hashlib.sha1(("%s %s" % cache_key).encode("utf-8")).hexdigest() + ".css"
+    path = os.path.join(domain_stylesheets, fname)
+    try: os.makedirs(domain_stylesheets, exist_ok=True)
+    except: pass
+    if not write_stylesheet(path, css):
+        return QUrl.fromLocalFile(generic_stylesheet).toString()
+    stylesheet_cache[cache_key] = QUrl.fromLocalFile(path).toString()
+    if len(stylesheet_cache) > domain_stylesheet_limit:
+        old_url = stylesheet_cache.popitem(last=False)[1]
+        try: os.remove(QUrl(old_url).toLocalFile())
+        except: pass
+    return stylesheet_cache[cache_key]
 
 # URLs for lists of rules.
 adblock_urls = ["https://easylist-downloads.adblockplus.org/easylist.txt",
@@ -41,27 +341,138 @@ hosts_urls = ["http://www.malwaredomainlist.com/hostslist/hosts.txt",
               "http://winhelp2002.mvps.org/hosts.txt",
               "http://malwaredomains.lehigh.edu/files/justdomains"]
 
-# Update everything.
-def download_rules():
-    for folder, urls in ((adblock_folder, adblock_urls), (hosts_folder, hosts_urls)):
-        print("Updating filters for %s..." % folder.split("/")[-1],)
+# Lists are kept with the ETag and Last-Modified headers they were served
+# with, so that unchanged lists aren't downloaded again.
+metadata_file = ".metadata.json"
+
+# Returns the paths of the lists in a folder. Dotfiles hold metadata and
+# partial downloads, and are skipped.
+def list_files(folder):
+    try: fnames = sorted(os.listdir(folder))
+    except: return []
+    return [os.path.join(folder, fname) for fname in fnames
+            if not fname.startswith(".") and os.path.isfile(os.path.join(folder, fname))]
+
+# Yields the lines of several lists one at a time, so that they can be fed
+# to the filters without holding the whole text in memory. Lists that can't
+# be read are skipped.
+def read_lines(paths):
+    for path in paths:
+        try: f = open(path, "r", encoding="utf-8", errors="replace")
+        except:
+            traceback.print_exc()
+            continue
+        try:
+            for line in f:
+                yield line
+        except:
+            traceback.print_exc()
+        finally:
+            f.close()
+
+def load_metadata(folder):
+    try: f = open(os.path.join(folder, metadata_file), "r")
+    except: return {}
+    try: return json.load(f)
+    except: return {}
+    finally: f.close()
+
+def save_metadata(folder, metadata):
+    temp_file = os.path.join(folder, metadata_file + ".part")
+    try:
+        f = open(temp_file, "w")
+        try: json.dump(metadata, f, indent=2, sort_keys=True)
+        finally: f.close()
+        os.replace(temp_file, os.path.join(folder, metadata_file))
+    except:
+        traceback.print_exc()
+
+# Download one list to path, with a conditional GET if it was downloaded
+# before. The list is written to a dotfile and moved into place once it
+# is complete. Returns the new metadata for the list, or None if it hasn't
+# changed.
+def download_list(url, path, entry=None):
+    request = urllib.request.Request(url)
+    if entry and entry.get("url") == url and os.path.isfile(path):
+        if entry.get("etag"):
+            request.add_header("If-None-Match", entry["etag"])
+        if entry.get("last_modified"):
+            request.add_header("If-Modified-Since", entry["last_modified"])
+    try: response = urllib.request.urlopen(request, timeout=60)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None
+        raise
+    folder, fname = os.path.split(path)
+    temp_file = os.path.join(folder, "." + fname + ".part")
+    try:
+        f = open(temp_file, "wb")
+        try: shutil.copyfileobj(response, f)
+        finally: f.close()
+        os.replace(temp_file, path)
+    except:
+        try: os.remove(temp_file)
+        except: pass
+        raise
+    finally:
+        response.close()
+    return {"url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")}
+
+# Update everything. All lists are downloaded at once; a list that fails
+# to download keeps its previous copy. Returns the folders with lists that
+# changed.
+def download_rules(lists=None):
+    if lists is None:
+        lists = ((adblock_folder, adblock_urls), (hosts_folder, hosts_urls))
+    jobs = []
+    metadata = {}
+    for folder, urls in lists:
         if not os.path.isdir(folder):
             os.makedirs(folder)
+        metadata[folder] = load_metadata(folder)
         for i in range(len(urls)):
-            fname = str(i) + ".txt"
-            print("Updating %s (using %s)..." % (fname, urls[i]))
-            urllib.request.urlretrieve(urls[i], os.path.join(folder, fname))
-            print("Done.")
-        print("Filters for %s updated." % folder.split("/")[-1],)
+            jobs.append((folder, str(i) + ".txt", urls[i]))
+    changed = set()
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(jobs)))
+    try:
+        futures = [(job, pool.submit(download_list, job[2], os.path.join(job[0], job[1]), metadata[job[0]].get(job[1])))
+                   for job in jobs]
+        for (folder, fname, url), future in futures:
+            try: entry = future.result()
+            except:
+                print("Failed to update %s (using %s)." % (fname, url))
+                traceback.print_exc()
+                continue
+            if entry is None:
+                print("%s is up to date (using %s)." % (fname, url))
+            else:
+                print("Updated %s (using %s)." % (fname, url))
+                metadata[folder][fname] = entry
+                changed.add(folder)
+    finally:
+        pool.shutdown()
+    for folder in changed:
+        save_metadata(folder, metadata[folder])
+    return changed
 
-# Update thread.
+# Update thread. Only the filters whose lists changed are rebuilt.
 class FilterUpdater(QThread):
     def __init__(self, *args, **kwargs):
         super(FilterUpdater, self).__init__(*args, **kwargs)
     def run(self):
+        global shelved_filter
         print("Updating content filters...")
-        download_rules()
-        load_host_rules()
+        changed = download_rules()
+        if hosts_folder in changed:
+            load_host_rules()
+        if adblock_folder in changed:
+            if settings.setting_to_bool("content/AdblockEnabled"):
+                load_adblock_rules(rebuild=True)
+            else:
+                with adblock_lock:
+                    shelved_filter = None
         print("All filters are up to date.")
 
 filter_updater = None
@@ -73,29 +484,117 @@ def update_filters():
     else:
         print("Already updating filters.")
 
-# Load adblock rules.
-def load_adblock_rules():
+# Returns the name, size, modification time and hash of every adblock
+# list. A snapshot is only valid for the exact signature it was made from.
+def adblock_signature():
+    signature = []
+    for path in list_files(adblock_folder):
+        try:
+            stat = os.stat(path)
+            f = open(path, "rb")
+        except:
+            continue
+        try: digest = hashlib.sha1(f.read()).hexdigest()
+        except: digest = None
+        f.close()
+        signature.append((os.path.basename(path), stat.st_size, stat.st_mtime, digest))
+    return signature
+
+# Load a compiled filter from the snapshot file. Returns None if there is
+# no snapshot or if it was made from different lists.
+def load_adblock_snapshot(signature):
+    try: f = open(adblock_snapshot, "rb")
+    except: return None
+    try:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except:
+        f.close()
+        return None
+    try:
+        if pickle.load(m) != (abpy.FORMAT_VERSION, signature):
+            return None
+        return pickle.load(m)
+    except:
+        traceback.print_exc()
+        return None
+    finally:
+        m.close()
+        f.close()
+
+# Save a compiled filter, pickled, to the snapshot file.
+def save_adblock_snapshot(signature, data):
+    try:
+        fd, temp_file = tempfile.mkstemp(dir=settings.settings_folder, suffix=".part")
+        f = os.fdopen(fd, "wb")
+        try:
+            pickle.dump((abpy.FORMAT_VERSION, signature), f, pickle.HIGHEST_PROTOCOL)
+            f.write(data)
+        finally:
+            f.close()
+        os.replace(temp_file, adblock_snapshot)
+    except:
+        traceback.print_exc()
+        try: os.remove(temp_file)
+        except: pass
+
+# Build a filter from the lists in a separate Python process running
+# filter_builder.py, which parses them in a pool of its own workers so that
+# parsing doesn't hold the GIL in the browser. The builder is started as its
+# own script rather than through multiprocessing, because spawned workers
+# re-import the main module, which here is the browser itself. Returns the
+# filter pickled.
+def build_adblock_filter(fnames):
+    if getattr(sys, "frozen", False):
+        raise RuntimeError("No Python interpreter to run the filter builder with.")
+    fd, output = tempfile.mkstemp(dir=settings.settings_folder, suffix=".build")
+    os.close(fd)
+    try:
+        subprocess.run([sys.executable, filter_builder, output] + fnames,
+                       stdin=subprocess.DEVNULL, check=True,
+                       timeout=filter_builder_timeout)
+        f = open(output, "rb")
+        try: return f.read()
+        finally: f.close()
+    finally:
+        try: os.remove(output)
+        except: pass
+
+# Load adblock rules. If rebuild is true, the shelved filter is ignored,
+# e.g. because the lists have changed.
+def load_adblock_rules(rebuild=False):
     global adblock_filter
-    global adblock_rules
     global shelved_filter
 
-    if len(adblock_rules) < 1:
-        if os.path.isdir(adblock_folder):
-            for fname in os.listdir(adblock_folder):
-                try:
-                    f = open(os.path.join(adblock_folder, fname))
-                    try: adblock_rules += f.read().split("\n")
-                    except: pass
-                    f.close()
-                except:
-                    pass
-
-    # Create instance of abpy.Filter.
-    if shelved_filter:
-        adblock_filter = shelved_filter
-    else:
-        adblock_filter = abpy.Filter(adblock_rules)
+    with adblock_lock:
+        if shelved_filter and not rebuild:
+            adblock_filter = shelved_filter
+            filters_changed()
+            return
+
+        # Try the snapshot first; parsing the lists takes a long time.
+        signature = adblock_signature()
+        new_filter = load_adblock_snapshot(signature)
+
+        if new_filter is None:
+            fnames = [os.path.join(adblock_folder, entry[0]) for entry in signature]
+            try:
+                data = build_adblock_filter(fnames)
+            except:
+                # Fall back to building the filter in this thread.
+                traceback.print_exc()
+                parsed = []
+                for fname in fnames:
+                    try: parsed.append(abpy.parse_file(fname))
+                    except: traceback.print_exc()
+                data = abpy.build_filter(parsed)
+            new_filter = pickle.loads(data)
+            save_adblock_snapshot(signature, data)
+
+        # Swap the new filter in with a single assignment, so createRequest
+        # never sees a half-built one.
+        adblock_filter = new_filter
         shelved_filter = adblock_filter
+        filters_changed()
 
 # Thread to load Adblock filters.
 class AdblockFilterLoader(QThread):
@@ -107,9 +606,11 @@ class AdblockFilterLoader(QThread):
         else:
             global adblock_filter
             global shelved_filter
-            if len(adblock_filter.index.keys()) > 0:
-                shelved_filter = adblock_filter
-            adblock_filter = abpy.Filter([])
+            with adblock_lock:
+                if len(adblock_filter) > 0:
+                    shelved_filter = adblock_filter
+                adblock_filter = abpy.Filter([])
+                filters_changed()
         self.quit()
 
 # Create thread to load adblock filters.
@@ -117,26 +618,32 @@ adblock_filter_loader = None
 
 # Host filter.
 hosts_file = os.path.join(paths.app_folder, "hosts")
-host_rules = []
+host_rules = abpy.HostFilter()
 
+# Builds a new host filter from the hosts files and swaps it in.
 def load_host_rules():
     global host_rules
-    host_rules = []
-    if os.path.isdir(hosts_folder):
-        for fname in os.listdir(hosts_folder):
-            try: f = open(os.path.join(hosts_folder, fname), "r")
-            except: traceback.print_exc()
-            else:
-                # This is a big hacky way of parsing the rules.
-                try:
-                    new_file = [line for line in [line.split(" ")[-1].replace("\n", "") for line in f.readlines() if not line.startswith("#") and len(line) > 1] if line != ""]
-                    host_rules += new_file
-                except:
-                    traceback.print_exc()
-                f.close()
+    new_rules = abpy.HostFilter()
+    for path in list_files(hosts_folder):
+        new_rules.add_lines(read_lines([path]), os.path.basename(path))
+    host_rules = new_rules
+    filters_changed()
+
+# Thread to load the hosts files.
+class HostRulesLoader(QThread):
+    def __init__(self, parent=None):
+        super(HostRulesLoader, self).__init__(parent)
+    def run(self):
+        load_host_rules()
+        self.quit()
+
+host_rules_loader = None
 
 def setup():
     global filter_updater
     global adblock_filter_loader
+    global host_rules_loader
     filter_updater = FilterUpdater(QCoreApplication.instance())
     adblock_filter_loader = AdblockFilterLoader(QCoreApplication.instance())
+    host_rules_loader = HostRulesLoader(QCoreApplication.instance())
+    enable_statistics(settings.setting_to_bool("content/FilterStatisticsEnabled"))
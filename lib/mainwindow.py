@@ -257,8 +257,13 @@ class MainWindow(QMainWindow):
         # Regularly and forcibly enable and disable navigation actions
         # every few milliseconds.
         self.timer = QTimer(timeout=self.toggleActions, parent=self)
-        WebPage.isOnlineTimer.timeout.connect(self.updateNetworkStatus)
+        network.connectivity_monitor.onlineChanged.connect(self.updateNetworkStatus)
         self.timer.timeout.connect(self.updateDateTime)
+
+        # The signal strength has no change notification, so it is polled,
+        # but only while the network action is shown (in fullscreen mode).
+        self.signalStrengthTimer = QTimer(timeout=self.updateSignalStrength, parent=self)
+        self.signalStrengthTimer.setInterval(5000)
         
         """closeTabsToolBar = QToolBar(movable=False,\
                            contextMenuPolicy=Qt.CustomContextMenu,\
@@ -1018,7 +1023,7 @@ class MainWindow(QMainWindow):
     def deleteLater(self):
         try: browser.windows.remove(self)
         except: pass
-        try: WebPage.isOnlineTimer.disconnect(self.updateNetworkStatus)
+        try: network.connectivity_monitor.onlineChanged.disconnect(self.updateNetworkStatus)
         except: pass
         QMainWindow.deleteLater(self)
 
@@ -1101,8 +1106,11 @@ class MainWindow(QMainWindow):
                     self._extensions.append(newExtension)
 
     # Updates the network status:
-    def updateNetworkStatus(self):
+    def updateNetworkStatus(self, online=None):
         self.networkManagerAction.setIcon(common.complete_icon("network-idle") if network.isConnectedToNetwork(self.currentWidget().url().toString()) else common.complete_icon("network-offline"))
+        self.updateSignalStrength()
+
+    def updateSignalStrength(self):
         self.networkManagerAction.setText(system.get_signal_strength())
 
     # Updates the time.
@@ -1403,6 +1411,8 @@ class MainWindow(QMainWindow):
             self.toggleFullScreenAction.setChecked(True)
             self.toggleFullScreenButton.setVisible(True)
             self.networkManagerAction.setVisible(True)
+            self.updateSignalStrength()
+            self.signalStrengthTimer.start()
             self.sessionMenuAction.setVisible(True)
             self.dateTime.setVisible(True)
             self.batteryAction.setVisible(True)
@@ -1413,6 +1423,7 @@ class MainWindow(QMainWindow):
             self.toggleFullScreenAction.setChecked(False)
             self.toggleFullScreenButton.setVisible(False)
             self.networkManagerAction.setVisible(False)
+            self.signalStrengthTimer.stop()
             self.sessionMenuAction.setVisible(False)
             self.dateTime.setVisible(False)
             self.batteryAction.setVisible(False)
@@ -1602,10 +1613,10 @@ class MainWindow(QMainWindow):
         count = self.tabWidget().count()
         for index in range(0, count):
             webView = self.tabWidget().widget(index)
-            ti = (("[%s] " % (str(index+1),) if index < 8 else ("[9] " if index == count-1 else "")) if settings.setting_to_bool("general/TabHotkeysVisible") else "") + webView.shortWindowTitle()
+            ti = (("[%s] " % (str(index+1),) if index < 8 else ("[9] " if index == count-1 else "")) if settings.typed.TabHotkeysVisible else "") + webView.shortWindowTitle()
             title = (ti if not webView.shortTempTitle() else webView.shortTempTitle())
             longtitle = webView.windowTitle()
-            self.tabWidget().setTabText(index, "\u26bf" if index < settings.setting_to_int("general/PinnedTabCount") else title)
+            self.tabWidget().setTabText(index, "\u26bf" if index < settings.typed.PinnedTabCount else title)
             if index == self.tabWidget().currentIndex():
                 self.setWindowTitle(longtitle + " - " + common.app_name)
 
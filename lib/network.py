@@ -12,20 +12,31 @@
 
 import sys
 import os
+import time
+import socket
+import base64
+import json
+import datetime
+import html
+import mmap
+import collections
+import mimetypes
+import urllib.parse
 import settings
 import filtering
+import extension_server
 import stringfunctions
 import random
 import settings
 import paths
 from translate import tr
 try:
-    from PyQt5.QtCore import QCoreApplication, QUrl, QTimer
+    from PyQt5.QtCore import QCoreApplication, QObject, QUrl, QTimer, QThread, QSocketNotifier, pyqtSignal
     from PyQt5.QtGui import QDesktopServices
     from PyQt5.QtWidgets import QInputDialog, QLineEdit
     from PyQt5.QtNetwork import QNetworkInterface, QNetworkCookieJar, QNetworkAccessManager, QNetworkDiskCache, QNetworkRequest, QNetworkReply
 except ImportError:
-    from PyQt4.QtCore import QCoreApplication, QUrl, QTimer
+    from PyQt4.QtCore import QCoreApplication, QObject, QUrl, QTimer, QThread, QSocketNotifier, pyqtSignal
     from PyQt4.QtGui import QDesktopServices, QInputDialog, QLineEdit
     from PyQt4.QtNetwork import QNetworkInterface, QNetworkCookieJar, QNetworkAccessManager, QNetworkDiskCache, QNetworkRequest, QNetworkReply
 
@@ -41,21 +52,28 @@ def setup():
     global cookie_jar
     global network_access_manager
     global incognito_network_access_manager
+    global connectivity_monitor
     cookie_jar = QNetworkCookieJar(QCoreApplication.instance())
     incognito_cookie_jar = QNetworkCookieJar(QCoreApplication.instance())
     network_access_manager = NetworkAccessManager()
     network_access_manager.setCookieJar(cookie_jar)
     incognito_network_access_manager = NetworkAccessManager(nocache=True)
     incognito_network_access_manager.setCookieJar(incognito_cookie_jar)
+    connectivity_monitor = ConnectivityMonitor(QCoreApplication.instance())
 
-# Subclass of QNetworkReply that loads a local folder.
+# Reply with content generated or loaded by Nimbus itself. content may be
+# a str, which is encoded once, or bytes, a bytearray, a memoryview or an
+# mmap, which are served as they are through a memoryview.
 class NetworkReply(QNetworkReply):
-    def __init__(self, parent, url, operation, content=""):
+    def __init__(self, parent, url, operation, content="", contentType="text/html; charset=UTF-8"):
         QNetworkReply.__init__(self, parent)
-        self.content = content
+        if type(content) is str:
+            content = content.encode("utf-8")
+        self.source = content
+        self.content = memoryview(content)
         self.offset = 0
-        self.setHeader(QNetworkRequest.ContentTypeHeader, "text/html; charset=UTF-8")
-        self.setHeader(QNetworkRequest.ContentLengthHeader, len(self.content))
+        self.setHeader(QNetworkRequest.ContentTypeHeader, contentType)
+        self.setHeader(QNetworkRequest.ContentLengthHeader, self.content.nbytes)
         try:
             QTimer.singleShot(0, self.readyRead)
             QTimer.singleShot(0, self.finished)
@@ -65,22 +83,70 @@ class NetworkReply(QNetworkReply):
         self.open(self.ReadOnly | self.Unbuffered)
         self.setUrl(url)
 
+    # Serves a local file, memory-mapped so that it isn't read into memory
+    # up front. Returns None if the file can't be opened.
+    @classmethod
+    def fromFile(cls, parent, url, path, contentType=None):
+        if contentType is None:
+            contentType = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            if contentType.startswith("text/"):
+                contentType += "; charset=UTF-8"
+        try: f = open(path, "rb")
+        except: return None
+        try:
+            if os.fstat(f.fileno()).st_size == 0:
+                content = b""
+            else:
+                content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except:
+            return None
+        finally:
+            f.close()
+        return cls(parent, url, QNetworkAccessManager.GetOperation, content, contentType)
+
     def abort(self):
         pass
 
+    def close(self):
+        QNetworkReply.close(self)
+        self.content.release()
+        self.content = memoryview(b"")
+        try: self.source.close()
+        except: pass
+
     def bytesAvailable(self):
-        return len(self.content) - self.offset
+        return len(self.content) - self.offset + QNetworkReply.bytesAvailable(self)
     
     def isSequential(self):
         return True
 
+    # PyQt has to be given a bytes object, so each chunk is copied once,
+    # straight out of the content.
     def readData(self, maxSize):
         if self.offset < len(self.content):
             end = min(self.offset + maxSize, len(self.content))
-            data = self.content[self.offset:end]
-            data = data.encode("utf-8")
+            data = self.content[self.offset:end].tobytes()
             self.offset = end
-            return bytes(data)
+            return data
+
+# The same transparent 1x1 GIF that used to be loaded from a data: URL.
+blank_gif = base64.b64decode(b"R0lGODlhAQABAHAAACH5BAUAAAAALAAAAAABAAEAAAICRAEAOw==")
+
+# What a blocked request gets instead, by Adblock Plus request type.
+blocked_contents = {"image": (blank_gif, "image/gif"),
+                    "script": (b"", "application/javascript"),
+                    "stylesheet": (b"", "text/css"),
+                    "subdocument": (b"", "text/html; charset=UTF-8"),
+                    "document": (b"", "text/html; charset=UTF-8")}
+
+# Reply for a blocked request. It is answered in-process from a constant,
+# so it never reaches Qt's network stack or opens a socket.
+class BlockedReply(NetworkReply):
+    def __init__(self, parent, request, elementtype=None):
+        content, contentType = blocked_contents.get(elementtype, (b"", "text/plain"))
+        super(BlockedReply, self).__init__(parent, request.url(), QNetworkAccessManager.GetOperation, content, contentType)
+        self.setRequest(request)
+        self.setAttribute(QNetworkRequest.HttpStatusCodeAttribute, 200)
 
 # This contains error types to be ignored.
 ignore = []
@@ -134,13 +200,467 @@ directoryView = """<!DOCTYPE html>
 </html>
 """
 
+# Streamed directory listings are made of these.
+directoryHeader = """<!DOCTYPE html>
+<html>
+    <head>
+        <meta charset="UTF-8"/>
+        <title>%(title)s</title>
+        <style type="text/css">td{padding-right:2em;}td.size{text-align:right;}</style>
+    </head>
+    <body>
+        <h1 style="margin-bottom: 0;">%(heading)s</h1>
+        <hr/>
+        %(pages)s
+        <table>
+            <tr><th align="left">%(name)s</th><th align="right">%(size)s</th><th align="left">%(modified)s</th></tr>
+            <tr><td><a href="%(parent)s">..</a></td><td></td><td></td></tr>
+"""
+
+directoryFooter = """
+        </table>
+        %(pages)s
+    </body>
+</html>
+"""
+
+# Entries per page of a directory listing, and per chunk sent to WebKit.
+directory_page_size = 1000
+directory_chunk_size = 250
+
+def formatSize(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return "%d %s" % (size, unit) if unit == "B" else "%.1f %s" % (size, unit)
+        size /= 1024.0
+    return "%.1f TB" % (size,)
+
+# Lists a folder with os.scandir on a worker thread and sends the listing
+# out in chunks of HTML. Entries are sorted by name, so the whole folder is
+# read before the first chunk, but only the requested page is formatted.
+# Sizes and times come from the DirEntry objects, which cache their stat.
+class DirectoryLister(QThread):
+    chunkReady = pyqtSignal(bytes)
+    def __init__(self, path, baseUrl, page=None, parent=None):
+        super(DirectoryLister, self).__init__(parent)
+        self.path = path
+        self.baseUrl = baseUrl
+        self.page = page
+        self.cancelled = False
+
+    def pageLinks(self, count, current):
+        if current is None or count <= directory_page_size:
+            return ""
+        pages = (count + directory_page_size - 1) // directory_page_size
+        links = []
+        for page in range(1, pages + 1):
+            if page == current:
+                links.append("<b>%s</b>" % (page,))
+            else:
+                links.append("<a href=\"?page=%s\">%s</a>" % (page, page))
+        return "<p>%s %s</p>" % (tr("Pages:"), " ".join(links))
+
+    def run(self):
+        heading = html.escape(self.path)
+        try:
+            iterator = os.scandir(self.path)
+            try: entries = sorted(iterator, key=lambda entry: entry.name)
+            finally:
+                try: iterator.close()
+                except: pass
+        except:
+            self.chunkReady.emit((directoryView % {"title": heading, "heading": heading, "links": tr("The contents of this directory could not be loaded.")}).encode("utf-8"))
+            return
+        # Folders too large to show at once are split into pages even when
+        # no page was asked for.
+        count = len(entries)
+        page = self.page
+        if page is None and count > directory_page_size * 10:
+            page = 1
+        if page is not None:
+            entries = entries[(page - 1) * directory_page_size:page * directory_page_size]
+        pages = self.pageLinks(count, page)
+        self.chunkReady.emit((directoryHeader % {"title": heading, "heading": heading, "pages": pages,
+                                                 "name": tr("Name"), "size": tr("Size"), "modified": tr("Modified"),
+                                                 "parent": self.baseUrl + ".."}).encode("utf-8"))
+        rows = []
+        for entry in entries:
+            if self.cancelled:
+                return
+            name = entry.name
+            try:
+                isdir = entry.is_dir()
+                stat = entry.stat()
+                size = "" if isdir else formatSize(stat.st_size)
+                modified = time.strftime("%Y-%m-%d %H:%M", time.localtime(stat.st_mtime))
+            except:
+                isdir = False
+                size = ""
+                modified = ""
+            if isdir:
+                name += "/"
+            rows.append("<tr><td><a href=\"%s\">%s</a></td><td class=\"size\">%s</td><td>%s</td></tr>\n" % (self.baseUrl + urllib.parse.quote(name), html.escape(name), size, modified))
+            if len(rows) >= directory_chunk_size:
+                self.chunkReady.emit("".join(rows).encode("utf-8"))
+                rows = []
+        rows.append(directoryFooter % {"pages": pages})
+        self.chunkReady.emit("".join(rows).encode("utf-8"))
+
+# Listers are kept here until they finish, since a reply can be deleted
+# while its lister is still running.
+directory_listers = set()
+
+# Reply that streams a directory listing from a DirectoryLister.
+class DirectoryReply(QNetworkReply):
+    def __init__(self, parent, url, path, page=None):
+        QNetworkReply.__init__(self, parent)
+        self.buffer = b""
+        self.offset = 0
+        self.done = False
+        self.setHeader(QNetworkRequest.ContentTypeHeader, "text/html; charset=UTF-8")
+        self.open(self.ReadOnly | self.Unbuffered)
+        self.setUrl(url)
+        baseUrl = url.toString(QUrl.RemoveQuery | QUrl.RemoveFragment)
+        if not baseUrl.endswith("/"):
+            baseUrl += "/"
+        self.lister = DirectoryLister(path, baseUrl, page)
+        self.lister.chunkReady.connect(self.appendChunk)
+        self.lister.finished.connect(self.finishListing)
+        directory_listers.add(self.lister)
+        self.lister.finished.connect(lambda lister=self.lister: directory_listers.discard(lister))
+        self.lister.start()
+
+    def appendChunk(self, chunk):
+        self.buffer = self.buffer[self.offset:] + chunk
+        self.offset = 0
+        self.readyRead.emit()
+
+    def finishListing(self):
+        self.done = True
+        self.finished.emit()
+
+    def abort(self):
+        self.lister.cancelled = True
+
+    def bytesAvailable(self):
+        return len(self.buffer) - self.offset + QNetworkReply.bytesAvailable(self)
+
+    def isSequential(self):
+        return True
+
+    def readData(self, maxSize):
+        if self.offset < len(self.buffer):
+            end = min(self.offset + maxSize, len(self.buffer))
+            data = self.buffer[self.offset:end]
+            self.offset = end
+            return data
+        return b"" if not self.done else None
+
 replacement_table = {}
 
+# Extensions expect the extension server here.
+extension_server_url = "http://127.0.0.1:%s/" % (extension_server.default_port,)
+
+operation_names = {QNetworkAccessManager.HeadOperation: "HEAD",
+                   QNetworkAccessManager.GetOperation: "GET",
+                   QNetworkAccessManager.PutOperation: "PUT",
+                   QNetworkAccessManager.PostOperation: "POST",
+                   QNetworkAccessManager.DeleteOperation: "DELETE"}
+
+# One request in the journal. Times are in seconds since the epoch; ttfb is
+# when the response headers arrived.
+class JournalEntry(object):
+    __slots__ = ("url", "method", "tab", "tabUrl", "elementtype", "reason",
+                 "started", "ttfb", "finished", "size", "fromCache",
+                 "status", "contentType")
+    def __init__(self, url, method, tab, tabUrl, elementtype, reason):
+        self.url = url
+        self.method = method
+        self.tab = tab
+        self.tabUrl = tabUrl
+        self.elementtype = elementtype
+        self.reason = reason
+        self.started = time.time()
+        self.ttfb = None
+        self.finished = None
+        self.size = 0
+        self.fromCache = False
+        self.status = 0
+        self.contentType = ""
+
+# Bounded log of recent requests: what was asked for, by which tab, whether
+# it was blocked and why, and how long it took. Shown at nimbus:requests,
+# and exported per tab as HAR at nimbus:requests.har?tab=n.
+class RequestJournal(object):
+    def __init__(self, size=1000):
+        super(RequestJournal, self).__init__()
+        self.resize(size)
+    # A size of 0 turns the journal off and drops what it has recorded.
+    def resize(self, size):
+        self.size = max(0, size)
+        self.entries = collections.deque(getattr(self, "entries", ()) if self.size else (), maxlen=self.size or 1)
+    def clear(self):
+        self.entries.clear()
+    def record(self, reply, op, request, elementtype, reason=None):
+        tab = 0
+        tabUrl = ""
+        try:
+            page = request.originatingObject().page()
+            tab = page.pageId
+            tabUrl = page.mainFrame().url().toString()
+        except:
+            pass
+        entry = JournalEntry(request.url().toString(), operation_names.get(op, "GET"), tab, tabUrl, elementtype, reason)
+        self.entries.append(entry)
+        reply.metaDataChanged.connect(lambda: self.gotHeaders(entry, reply))
+        reply.finished.connect(lambda: self.finished(entry, reply))
+        return entry
+    def gotHeaders(self, entry, reply):
+        if entry.ttfb is None:
+            entry.ttfb = time.time()
+        try: entry.status = int(reply.attribute(QNetworkRequest.HttpStatusCodeAttribute) or 0)
+        except: pass
+        try: entry.contentType = str(reply.header(QNetworkRequest.ContentTypeHeader) or "")
+        except: pass
+    # The size is taken from the headers once the reply is done, rather
+    # than counted as data arrives, to keep the journal off the download
+    # path.
+    def finished(self, entry, reply):
+        entry.finished = time.time()
+        if entry.ttfb is None:
+            self.gotHeaders(entry, reply)
+        try: entry.size = int(reply.header(QNetworkRequest.ContentLengthHeader) or 0)
+        except: pass
+        try: entry.fromCache = bool(reply.attribute(QNetworkRequest.SourceIsFromCacheAttribute))
+        except: pass
+    def tabs(self):
+        tabs = collections.OrderedDict()
+        for entry in self.entries:
+            tabs[entry.tab] = entry.tabUrl
+        return tabs
+    def to_html(self):
+        rows = []
+        for entry in reversed(self.entries):
+            ttfb = "%d" % ((entry.ttfb - entry.started) * 1000) if entry.ttfb else ""
+            total = "%d" % ((entry.finished - entry.started) * 1000) if entry.finished else ""
+            rows.append("<tr><td>%s</td><td>%s</td><td>%s</td><td title=\"%s\">%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td><td>%s</td></tr>" %
+                        (time.strftime("%H:%M:%S", time.localtime(entry.started)),
+                         html.escape(entry.method),
+                         html.escape(entry.elementtype or ""),
+                         html.escape(entry.url),
+                         html.escape(entry.url[:100]),
+                         html.escape(entry.tabUrl[:60]),
+                         html.escape(entry.reason or tr("allowed")),
+                         entry.status or "",
+                         ttfb, total,
+                         formatSize(entry.size) + (" (%s)" % (tr("cached"),) if entry.fromCache else "")))
+        tabs = "".join("<li><a href=\"nimbus:requests.har?tab=%s\">%s</a></li>" % (tab, html.escape(tabUrl or tr("(unknown)"))) for tab, tabUrl in self.tabs().items())
+        return requestJournalTemplate % {"title": tr("Requests"), "tabs": tabs,
+                                     "export": tr("Export a tab's requests as HAR:"),
+                                     "headings": "".join("<th align=\"left\">%s</th>" % (heading,) for heading in (tr("Time"), tr("Method"), tr("Type"), tr("URL"), tr("Tab"), tr("Verdict"), tr("Status"), tr("TTFB (ms)"), tr("Total (ms)"), tr("Size"))),
+                                     "rows": "\n".join(rows)}
+    # Returns the entries for one tab, or for all of them, in HAR 1.2
+    # format.
+    def to_har(self, tab=None):
+        entries = []
+        for entry in self.entries:
+            if tab is not None and entry.tab != tab:
+                continue
+            wait = ((entry.ttfb or entry.finished or entry.started) - entry.started) * 1000
+            receive = ((entry.finished - (entry.ttfb or entry.finished)) * 1000) if entry.finished else 0
+            url = QUrl(entry.url)
+            har_entry = {"startedDateTime": datetime.datetime.fromtimestamp(entry.started, datetime.timezone.utc).isoformat(),
+                         "time": wait + receive,
+                         "request": {"method": entry.method,
+                                     "url": entry.url,
+                                     "httpVersion": "HTTP/1.1",
+                                     "headers": [],
+                                     "queryString": [{"name": name, "value": value} for name, value in urllib.parse.parse_qsl(url.query(), keep_blank_values=True)],
+                                     "cookies": [],
+                                     "headersSize": -1,
+                                     "bodySize": -1},
+                         "response": {"status": entry.status,
+                                      "statusText": "",
+                                      "httpVersion": "HTTP/1.1",
+                                      "headers": [],
+                                      "cookies": [],
+                                      "content": {"size": entry.size, "mimeType": entry.contentType},
+                                      "redirectURL": "",
+                                      "headersSize": -1,
+                                      "bodySize": entry.size},
+                         "cache": {},
+                         "timings": {"send": 0, "wait": wait, "receive": receive},
+                         "pageref": "tab%s" % (entry.tab,)}
+            if entry.elementtype:
+                har_entry["_type"] = entry.elementtype
+            if entry.reason:
+                har_entry["_blocked"] = entry.reason
+            if entry.fromCache:
+                har_entry["cache"]["afterRequest"] = {"lastAccess": har_entry["startedDateTime"], "eTag": "", "hitCount": 1}
+            entries.append(har_entry)
+        started = {}
+        for entry in self.entries:
+            if entry.tab not in started:
+                started[entry.tab] = entry.started
+        pages = [{"id": "tab%s" % (t,), "title": tabUrl, "startedDateTime": datetime.datetime.fromtimestamp(started[t], datetime.timezone.utc).isoformat(), "pageTimings": {}}
+                 for t, tabUrl in self.tabs().items() if tab is None or t == tab]
+        return {"log": {"version": "1.2",
+                        "creator": {"name": "Nimbus", "version": app_version()},
+                        "pages": pages,
+                        "entries": entries}}
+
+def app_version():
+    try: f = open(paths.app_version_file, "r")
+    except: return ""
+    try: return f.read().strip()
+    except: return ""
+    finally: f.close()
+
+requestJournalTemplate = """<!DOCTYPE html>
+<html>
+    <head>
+        <meta charset="UTF-8"/>
+        <title>%(title)s</title>
+        <style type="text/css">html{font-family:sans-serif;font-size:small;}td{padding-right:1em;white-space:nowrap;}</style>
+    </head>
+    <body>
+        <h1>%(title)s</h1>
+        <p>%(export)s</p>
+        <ul>%(tabs)s</ul>
+        <table>
+            <tr>%(headings)s</tr>
+            %(rows)s
+        </table>
+    </body>
+</html>
+"""
+
+request_journal = RequestJournal(settings.setting_to_int("network/RequestJournalSize"))
+
+# Filter statistics page.
+def filterStatisticsPage(query=None):
+    if filtering.statistics is None:
+        return directoryView % {"title": tr("Filter Statistics"), "heading": tr("Filter Statistics"), "links": tr("Filter statistics are not being collected. They can be turned on under Settings > Content.")}, "text/html; charset=UTF-8"
+    return filtering.statistics.to_html(), "text/html; charset=UTF-8"
+
+def filterStatisticsJSON(query=None):
+    if filtering.statistics is None:
+        return "{}", "application/json"
+    return filtering.statistics.to_json(), "application/json"
+
+def requestJournalPage(query=None):
+    if not request_journal.size:
+        return directoryView % {"title": tr("Requests"), "heading": tr("Requests"), "links": tr("Requests are not being recorded. Recording can be turned on under Settings > Network.")}, "text/html; charset=UTF-8"
+    return request_journal.to_html(), "text/html; charset=UTF-8"
+
+def requestJournalHAR(query=None):
+    tab = None
+    try: tab = int(query["tab"][0])
+    except: pass
+    return json.dumps(request_journal.to_har(tab), indent=2), "application/json"
+
+# Pages generated by Nimbus itself, keyed by their path under nimbus:.
+# Each function is given the parsed query string and returns the content
+# of the page and its content type.
+internal_pages = {"filterstats": filterStatisticsPage,
+                  "filterstats.json": filterStatisticsJSON,
+                  "requests": requestJournalPage,
+                  "requests.har": requestJournalHAR}
+
+# Adblock Plus request types for file extensions, used when a request's
+# headers don't give its type away.
+extension_types = {"js": "script", "css": "stylesheet", "png": "image",
+                   "jpg": "image", "jpeg": "image", "gif": "image",
+                   "webp": "image", "svg": "image", "ico": "image",
+                   "bmp": "image", "swf": "object", "woff": "font",
+                   "woff2": "font", "ttf": "font", "otf": "font",
+                   "eot": "font", "mp3": "media", "mp4": "media",
+                   "ogg": "media", "webm": "media", "wav": "media",
+                   "flv": "media"}
+
+# Works out the Adblock Plus request type of a request and the URL of the
+# document that made it, using the frame that started the request.
+def requestInfo(request):
+    frame = request.originatingObject()
+    try: parentFrame = frame.parentFrame()
+    except:
+        frame = None
+        parentFrame = None
+    accept = bytes(request.rawHeader(b"Accept")).decode("latin-1")
+    if accept.startswith("text/html"):
+        if frame is None or parentFrame is None:
+            return "document", None
+        return "subdocument", parentFrame.url().toString()
+    documentUrl = frame.url().toString() if frame is not None else None
+    if accept.startswith("text/css"):
+        return "stylesheet", documentUrl
+    if accept.startswith("image/"):
+        return "image", documentUrl
+    if bytes(request.rawHeader(b"X-Requested-With")) == b"XMLHttpRequest":
+        return "xmlhttprequest", documentUrl
+    path = request.url().path()
+    extension = path.rsplit(".", 1)[-1].lower() if "." in path else ""
+    return extension_types.get(extension, "other"), documentUrl
+
+# Disk cache that evicts the least recently used entries once it grows past
+# its maximum size, instead of the oldest ones. Entries used since launch
+# are ordered by when they were last read; the rest by when they were
+# written.
+class DiskCache(QNetworkDiskCache):
+    def __init__(self, folder, parent=None):
+        super(DiskCache, self).__init__(parent)
+        self.accessed = {}
+        self.setCacheDirectory(folder)
+        self.applySettings()
+    def applySettings(self):
+        self.setMaximumCacheSize(max(1, settings.setting_to_int("data/MaximumCacheSize")) * 1048576)
+    def data(self, url):
+        device = QNetworkDiskCache.data(self, url)
+        if device is not None:
+            self.accessed[url.toString()] = time.time()
+        return device
+    def clear(self):
+        self.accessed.clear()
+        QNetworkDiskCache.clear(self)
+    # Called by Qt when the cache is over its maximum size. Removes entries
+    # until it is below nine tenths of it, so that this doesn't run again
+    # on the next insert. Returns the new size of the cache.
+    def expire(self):
+        entries = []
+        size = 0
+        for root, dirs, fnames in os.walk(self.cacheDirectory()):
+            # Entries that are still being written.
+            if "prepared" in dirs:
+                dirs.remove("prepared")
+            for fname in fnames:
+                path = os.path.join(root, fname)
+                try: stat = os.stat(path)
+                except: continue
+                size += stat.st_size
+                entries.append((path, stat.st_size, stat.st_mtime))
+        if size <= self.maximumCacheSize():
+            return size
+        goal = self.maximumCacheSize() * 9 // 10
+        def lastUsed(entry):
+            url = self.fileMetaData(entry[0]).url().toString()
+            return self.accessed.get(url, entry[2])
+        entries.sort(key=lastUsed)
+        for path, fsize, mtime in entries:
+            if size <= goal:
+                break
+            try: os.remove(path)
+            except: continue
+            size -= fsize
+        return size
+
 # Custom NetworkAccessManager class with support for ad-blocking.
+# Incognito managers are created with nocache=True and only use WebKit's
+# memory cache.
 class NetworkAccessManager(QNetworkAccessManager):
-    #diskCache = diskCache
     def __init__(self, *args, nocache=False, **kwargs):
         super(NetworkAccessManager, self).__init__(*args, **kwargs)
+        if not nocache:
+            self.setCache(DiskCache(settings.network_cache_folder, self))
         self.authenticationRequired.connect(self.provideAuthentication)
     def provideAuthentication(self, reply, auth):
         username = QInputDialog.getText(None, "Authentication", "Enter your username:", QLineEdit.Normal)
@@ -154,37 +674,186 @@ class NetworkAccessManager(QNetworkAccessManager):
         ctype = str(request.header(QNetworkRequest.ContentTypeHeader))
         urlString = url.toString()
         lurlString = urlString.lower()
-        x = filtering.adblock_filter.match(urlString)
-        y = url.authority() in filtering.host_rules if settings.setting_to_bool("content/HostFilterEnabled") and url.authority() != "" else False
-        z = (lurlString.endswith(".swf") or "flash" in ctype) and not settings.setting_to_bool("content/FlashEnabled")
-        aa = (lurlString.endswith(".gif") or "image/gif" in ctype) and not settings.setting_to_bool("content/GIFsEnabled")
+        elementtype, documentUrl = requestInfo(request)
+        x, y = filtering.check_request(urlString, elementtype, documentUrl, settings.typed.HostFilterEnabled)
+        z = (lurlString.endswith(".swf") or "flash" in ctype) and not settings.typed.FlashEnabled
+        aa = (lurlString.endswith(".gif") or "image/gif" in ctype) and not settings.typed.GIFsEnabled
         if x != None or y or z or aa:
-            return QNetworkAccessManager.createRequest(self, self.GetOperation, QNetworkRequest(QUrl(random.choice(("http://www.randomkittengenerator.com/images/cats/rotator.php", "http://thecatapi.com/api/images/get?format=src&type=png&size=small")) if settings.setting_to_bool("content/KittensEnabled") else "data:image/gif;base64,R0lGODlhAQABAHAAACH5BAUAAAAALAAAAAABAAEAAAICRAEAOw==")))
-        if urlString in tuple(replacement_table.keys()):
+            # Kittens are opt-in, and only replace images.
+            if elementtype == "image" and settings.typed.KittensEnabled:
+                reply = QNetworkAccessManager.createRequest(self, self.GetOperation, QNetworkRequest(QUrl(random.choice(("http://www.randomkittengenerator.com/images/cats/rotator.php", "http://thecatapi.com/api/images/get?format=src&type=png&size=small")))))
+            else:
+                reply = BlockedReply(self, request, elementtype)
+            if request_journal.size:
+                if x != None:
+                    reason = "adblock: " + x.rule_str
+                elif y:
+                    reason = "hosts: %s" % (y,)
+                else:
+                    reason = "flash policy" if z else "gif policy"
+                request_journal.record(reply, op, request, elementtype, reason)
+            return reply
+        reply = self.dispatchRequest(op, request, device, urlString)
+        if request_journal.size:
+            request_journal.record(reply, op, request, elementtype)
+        return reply
+
+    def dispatchRequest(self, op, request, device, urlString):
+        if replacement_table and urlString in replacement_table:
             return QNetworkAccessManager.createRequest(self, op, QNetworkRequest(QUrl(replacement_table[urlString])), device)
-        if url.scheme() == "file" and os.path.isdir(os.path.abspath(url.path())):
-            try:
-                html = directoryView % {"title": urlString, "heading": url.path(), "links": "".join(["<a href=\"%s\">%s</a><br/>" % (QUrl.fromUserInput(os.path.join(urlString, path)).toString(), path,) for path in [".."] + sorted(os.listdir(os.path.abspath(url.path())))])}
-            except:
-                html = directoryView % {"title": urlString, "heading": url.path(), "links": tr("The contents of this directory could not be loaded.")}
-            return NetworkReply(self, url, self.GetOperation, html)
-        if url.scheme() == "nimbus-extension":
-            request.setUrl(QUrl("http://127.0.0.1:8133/" + stringfunctions.chop(url.toString(QUrl.RemoveScheme), "//")))
-            return QNetworkAccessManager.createRequest(self, op, request, device)
-        if url.scheme() == "nimbus":
-            request.setUrl(QUrl("file://%s/" % (paths.app_folder,) + stringfunctions.chop(url.toString(QUrl.RemoveScheme), "//")))
-            return self.createRequest(op, request, device)
-        if url.scheme() == "nimbus-settings":
-            request.setUrl(QUrl("file://%s/" % (settings.settings_folder,) + stringfunctions.chop(url.toString(QUrl.RemoveScheme), "//")))
-            return self.createRequest(op, request, device)
-        if url.scheme() == "apt":
-            os.system("xterm -e \"sudo apt-get install %s\" &" % (stringfunctions.chop(url.toString(QUrl.RemoveScheme), "//").split("&")[0],))
-            return QNetworkAccessManager.createRequest(self, self.GetOperation, QNetworkRequest(QUrl("")))
-        if url.scheme() == "mailto":
-            QDesktopServices.openUrl(url)
-            return QNetworkAccessManager.createRequest(self, self.GetOperation, QNetworkRequest(QUrl("")))
-        else:
-            return QNetworkAccessManager.createRequest(self, op, request, device)
+        # Extension files are read from the cache in-process, without a
+        # round trip to the extension server. It only sees other requests.
+        if op == self.GetOperation and urlString.startswith(extension_server_url):
+            return extensionReply(self, urlString[len(extension_server_url):])
+        # The extension server couldn't get its usual port.
+        if extension_server.port not in (None, extension_server.default_port) and urlString.startswith(extension_server_url):
+            request.setUrl(QUrl("http://127.0.0.1:%s/" % (extension_server.port,) + urlString[len(extension_server_url):]))
+        handler = scheme_handlers.get(request.url().scheme())
+        if handler is not None:
+            reply = handler(self, op, request, device)
+            if reply is not None:
+                return reply
+        return QNetworkAccessManager.createRequest(self, op, request, device)
+
+# Handlers for URL schemes, keyed by scheme. A handler is called with the
+# NetworkAccessManager, operation, request and outgoing data, and returns a
+# reply, or None to leave the request to Qt.
+scheme_handlers = {}
+
+def register_scheme_handler(scheme, handler):
+    scheme_handlers[scheme] = handler
+
+def unregister_scheme_handler(scheme):
+    try: del scheme_handlers[scheme]
+    except: pass
+
+# Lists the contents of local folders. ?page=n shows one page of a large
+# folder.
+def fileHandler(manager, op, request, device):
+    url = request.url()
+    path = os.path.abspath(url.path())
+    if not os.path.isdir(path):
+        return None
+    page = None
+    query = urllib.parse.parse_qs(url.query())
+    if "page" in query:
+        try: page = max(1, int(query["page"][0]))
+        except: pass
+    return DirectoryReply(manager, url, path, page)
+
+# Loads a file from a local folder directly, for schemes that are aliases
+# for folders.
+def localFolderRequest(manager, op, request, device, folder):
+    request.setUrl(QUrl("file://%s/" % (folder,) + stringfunctions.chop(request.url().toString(QUrl.RemoveScheme), "//")))
+    path = os.path.abspath(request.url().path())
+    reply = None
+    if os.path.isfile(path):
+        reply = NetworkReply.fromFile(manager, request.url(), path)
+    else:
+        reply = fileHandler(manager, op, request, device)
+    if reply is not None:
+        return reply
+    return QNetworkAccessManager.createRequest(manager, op, request, device)
+
+# In-memory cache of extension files, so that nimbus-extension:// doesn't
+# go through the extension server. Entries are dropped when their file's
+# modification time or size changes, and the least recently used ones once
+# the cache holds more than maxSize bytes.
+class ExtensionCache(object):
+    def __init__(self, maxSize=16*1048576):
+        super(ExtensionCache, self).__init__()
+        self.maxSize = maxSize
+        self.size = 0
+        self.entries = collections.OrderedDict()
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+    # Returns the contents of a file, or None if it can't be read.
+    def get(self, path):
+        try: stat = os.stat(path)
+        except: return None
+        key = (stat.st_mtime, stat.st_size)
+        entry = self.entries.get(path)
+        if entry is not None:
+            if entry[0] == key:
+                self.entries.move_to_end(path)
+                return entry[1]
+            del self.entries[path]
+            self.size -= len(entry[1])
+        try: f = open(path, "rb")
+        except: return None
+        try: content = f.read()
+        except: return None
+        finally: f.close()
+        if len(content) <= self.maxSize:
+            self.entries[path] = (key, content)
+            self.size += len(content)
+            while self.size > self.maxSize:
+                oldPath, oldEntry = self.entries.popitem(last=False)
+                self.size -= len(oldEntry[1])
+        return content
+
+extension_cache = ExtensionCache()
+
+# Serves a file from the extensions folder, given its path under
+# extension_server_url. The reply has the URL the extension server would
+# have had, so that extensions see the same origin as before.
+def extensionReply(manager, path):
+    replyUrl = QUrl(extension_server_url + path)
+    path = urllib.parse.unquote(path.split("#")[0].split("?")[0])
+    folder = os.path.abspath(settings.extensions_folder)
+    fullPath = os.path.abspath(os.path.join(folder, path))
+    status = None
+    if fullPath != folder and not fullPath.startswith(folder + os.sep):
+        status = 403
+    else:
+        if os.path.isdir(fullPath):
+            fullPath = os.path.join(fullPath, "index.html")
+        content = extension_cache.get(fullPath)
+        if content is None:
+            status = 404
+    if status is not None:
+        reply = NetworkReply(manager, replyUrl, manager.GetOperation, errorPage(replyUrl, status))
+        reply.setAttribute(QNetworkRequest.HttpStatusCodeAttribute, status)
+        return reply
+    contentType = mimetypes.guess_type(fullPath)[0] or "application/octet-stream"
+    if contentType.startswith("text/") or contentType in ("application/javascript", "application/json"):
+        contentType += "; charset=UTF-8"
+    return NetworkReply(manager, replyUrl, manager.GetOperation, content, contentType)
+
+def nimbusExtensionHandler(manager, op, request, device):
+    return extensionReply(manager, stringfunctions.chop(request.url().toString(QUrl.RemoveScheme), "//"))
+
+# nimbus: serves internal pages and files from the application folder.
+def nimbusHandler(manager, op, request, device):
+    url = request.url()
+    path = stringfunctions.chop(url.toString(QUrl.RemoveScheme), "//")
+    page, query = path.split("?", 1) if "?" in path else (path, "")
+    if page in internal_pages:
+        content, contentType = internal_pages[page](urllib.parse.parse_qs(query))
+        reply = NetworkReply(manager, url, manager.GetOperation, content, contentType)
+        if page.endswith(".har"):
+            reply.setRawHeader(b"Content-Disposition", b"attachment; filename=\"requests.har\"")
+        return reply
+    return localFolderRequest(manager, op, request, device, paths.app_folder)
+
+def nimbusSettingsHandler(manager, op, request, device):
+    return localFolderRequest(manager, op, request, device, settings.settings_folder)
+
+def aptHandler(manager, op, request, device):
+    os.system("xterm -e \"sudo apt-get install %s\" &" % (stringfunctions.chop(request.url().toString(QUrl.RemoveScheme), "//").split("&")[0],))
+    return QNetworkAccessManager.createRequest(manager, manager.GetOperation, QNetworkRequest(QUrl("")))
+
+def mailtoHandler(manager, op, request, device):
+    QDesktopServices.openUrl(request.url())
+    return QNetworkAccessManager.createRequest(manager, manager.GetOperation, QNetworkRequest(QUrl("")))
+
+register_scheme_handler("file", fileHandler)
+register_scheme_handler("nimbus-extension", nimbusExtensionHandler)
+register_scheme_handler("nimbus", nimbusHandler)
+register_scheme_handler("nimbus-settings", nimbusSettingsHandler)
+register_scheme_handler("apt", aptHandler)
+register_scheme_handler("mailto", mailtoHandler)
 
 def apply_proxy():
     proxyType = str(settings.settings.value("proxy/Type"))
@@ -204,7 +873,17 @@ def apply_proxy():
 
 # Clear cache.
 def clear_cache():
-    pass
+    try: cache = network_access_manager.cache()
+    except: return
+    if cache is not None:
+        cache.clear()
+
+# Apply cache settings.
+def apply_cache_settings():
+    try: cache = network_access_manager.cache()
+    except: return
+    if cache is not None:
+        cache.applySettings()
 
 # This function checks whether the system is connected to a network interface.
 # It is used by Nimbus to determine whether the system is connected to the
@@ -212,7 +891,7 @@ def clear_cache():
 # Ported from http://stackoverflow.com/questions/2475266/verfiying-the-network-connection-using-qt-4-4
 # and http://stackoverflow.com/questions/13533710/pyqt-convert-enum-value-to-key
 # and http://stackoverflow.com/questions/3764291/checking-network-connection
-def isConnectedToNetwork(reference=None):
+def checkNetworkInterfaces():
     ifaces = QNetworkInterface.allInterfaces()
     result = False
     for iface in ifaces:
@@ -221,3 +900,56 @@ def isConnectedToNetwork(reference=None):
                 result = True
                 break
     return result
+
+# rtnetlink multicast groups for link and address changes.
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+
+# Keeps track of whether the system is online, for the whole process. On
+# Linux it listens for interface changes on a netlink socket and only looks
+# at the interfaces when the kernel reports one; elsewhere it checks them
+# every few seconds. onlineChanged is only emitted when the state changes.
+class ConnectivityMonitor(QObject):
+    onlineChanged = pyqtSignal(bool)
+    def __init__(self, parent=None, interval=5000):
+        super(ConnectivityMonitor, self).__init__(parent)
+        self.online = checkNetworkInterfaces()
+        self.socket = None
+        self.notifier = None
+        self.timer = None
+        try:
+            self.socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            self.socket.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+            self.socket.setblocking(False)
+        except:
+            if self.socket is not None:
+                self.socket.close()
+            self.socket = None
+            self.timer = QTimer(self)
+            self.timer.timeout.connect(self.update)
+            self.timer.start(interval)
+        else:
+            self.notifier = QSocketNotifier(self.socket.fileno(), QSocketNotifier.Read, self)
+            self.notifier.activated.connect(self.netlinkEvent)
+    # Drains the netlink socket; the messages themselves aren't needed.
+    def netlinkEvent(self, *args):
+        try:
+            while self.socket.recv(65536):
+                pass
+        except:
+            pass
+        self.update()
+    def update(self):
+        online = checkNetworkInterfaces()
+        if online != self.online:
+            self.online = online
+            self.onlineChanged.emit(online)
+        return online
+
+connectivity_monitor = None
+
+def isConnectedToNetwork(reference=None):
+    if connectivity_monitor is not None:
+        return connectivity_monitor.online
+    return checkNetworkInterfaces()
@@ -94,7 +94,10 @@ def prepareQuit():
     data.data.hardSync()
     filtering.adblock_filter_loader.quit()
     filtering.adblock_filter_loader.wait()
-    server_thread.httpd.shutdown()
+    filtering.host_rules_loader.wait()
+    filtering.dump_statistics()
+    if server_thread.httpd is not None:
+        server_thread.httpd.shutdown()
     server_thread.quit()
     server_thread.wait()
 
@@ -369,7 +372,7 @@ def main(argv):
         common.trayIcon.showMessage(tr("Downloading content filters"), ("Ad blocking and host filtering will not work until this completes."))
         filtering.update_filters()
     else:
-        filtering.load_host_rules()
+        filtering.host_rules_loader.start()
 
     # Start app.
     print("Kon~!")
@@ -47,9 +47,9 @@ Slot = pyqtSlot
 
 # Add an item to the browser history.
 def addHistoryItem(url, title=None):
-    if settings.setting_to_bool("data/RememberHistory"):
+    if settings.typed.RememberHistory:
         url = url.split("#")[0]
-        if len(url) <= settings.setting_to_int("data/MaximumURLLength"):
+        if len(url) <= settings.typed.MaximumURLLength:
             data.history[url] = {"title": title, "last_visited" : QDateTime.currentDateTime().toMSecsSinceEpoch()}
 
 mtype_associations = (("python", "py"),
@@ -220,11 +220,16 @@ class WebPage(QWebPage):
     javaScriptBar = Signal(QWidget)
     factory = PDFFactory(incognito=False)
     incognito_factory = PDFFactory()
-    
-    isOnlineTimer = QTimer(QCoreApplication.instance())
+
+    # Number of pages created so far. Each page is numbered, so that it can
+    # be told apart from pages that used to exist, e.g. in the request
+    # journal.
+    page_count = 0
     
     def __init__(self, *args, **kwargs):
         super(WebPage, self).__init__(*args, **kwargs)
+        WebPage.page_count += 1
+        self.pageId = WebPage.page_count
         try: incognito = self.parent().incognito
         except: pass
         else:
@@ -246,6 +251,11 @@ class WebPage(QWebPage):
         self._userScriptsLoaded = False
         self.mainFrame().javaScriptWindowObjectCleared.connect(lambda: self.setUserScriptsLoaded(False))
 
+        # Element hiding rules are applied as a user stylesheet as soon as
+        # the new page is committed, so ads are hidden before layout.
+        self._elementHidingUrl = ""
+        self.mainFrame().urlChanged.connect(self.applyElementHiding)
+
         # Connect to self.tweakDOM, which carries out some hacks to
         # improve HTML5 support.
         self.mainFrame().javaScriptWindowObjectCleared.connect(self.tweakDOM)
@@ -261,10 +271,13 @@ class WebPage(QWebPage):
         # This stores the user agent.
         self._userAgent = ""
 
-        # Start self.isOnlineTimer.
-        self.isOnlineTimer.timeout.connect(self.setNavigatorOnline)
-        if not self.isOnlineTimer.isActive():
-            self.isOnlineTimer.start(5000)
+        # navigator.onLine is set on every new document and updated when
+        # the connection goes up or down. Pages that aren't visible are
+        # updated when they are shown again. This holds the state last
+        # given to the current document.
+        self._navigatorOnline = None
+        try: network.connectivity_monitor.onlineChanged.connect(self.onlineChanged)
+        except: pass
 
         # Set user agent to default value.
         self.setUserAgent()
@@ -304,14 +317,27 @@ class WebPage(QWebPage):
             return QWebPage.extension(self, extension, option, output)
 
     def deleteLater(self):
-        try: self.isOnlineTimer.timeout.disconnect(self.setNavigatorOnline)
+        try: network.connectivity_monitor.onlineChanged.disconnect(self.onlineChanged)
         except: pass
         QWebPage.deleteLater(self)
 
+    def onlineChanged(self, online):
+        view = self.view()
+        if view is None or view.isVisible():
+            self.setNavigatorOnline()
+
+    # Tells the page whether the browser is online, if it doesn't know yet.
+    # The online or offline event is only fired for changes.
     def setNavigatorOnline(self):
         online = bool(network.isConnectedToNetwork(self.mainFrame().url().toString()))
+        if online == self._navigatorOnline:
+            return
+        changed = self._navigatorOnline is not None
+        self._navigatorOnline = online
         script = "window.navigator.onLine = " + str(online).lower() + ";"
         self.mainFrame().evaluateJavaScript(script)
+        if not changed:
+            return
         if online:
             try: self.mainFrame().evaluateJavaScript("document.dispatchEvent(window.nimbus.onLineEvent);")
             except: pass
@@ -319,6 +345,16 @@ class WebPage(QWebPage):
             try: self.mainFrame().evaluateJavaScript("document.dispatchEvent(window.nimbus.offLineEvent);")
             except: pass
 
+    def applyElementHiding(self, url):
+        # Leave alone pages that were given a stylesheet of their own,
+        # such as sidebars.
+        if not self._elementHidingUrl and self.settings().userStyleSheetUrl().toString():
+            return
+        styleSheetUrl = filtering.stylesheet_url(url.toString())
+        if styleSheetUrl != self._elementHidingUrl:
+            self._elementHidingUrl = styleSheetUrl
+            self.settings().setUserStyleSheetUrl(QUrl(styleSheetUrl))
+
     def javaScriptAlert(self, frame, msg, title="JavaScript Alert:"):
         pause = QEventLoop()
         tb = QToolBar(parent=self.parent(), movable=False)
@@ -477,15 +513,6 @@ class WebPage(QWebPage):
     def loadUserScripts(self):
         if not self._userScriptsLoaded:
             self._userScriptsLoaded = True
-            if settings.setting_to_bool("content/HostFilterEnabled") or settings.setting_to_bool("content/AdblockEnabled"):
-                self.mainFrame().evaluateJavaScript("""var __NimbusAdRemoverQueries = %s;
-for (var i=0; i<__NimbusAdRemoverQueries.length; i++) {
-    var cl = document.querySelectorAll(__NimbusAdRemoverQueries[i]);
-    for (var j=0; j<cl.length; j++) {
-        cl[j].style.display = "none";
-    }
-}
-delete __NimbusAdRemoverQueries;""" % (settings.adremover_filters,))
             self.mainFrame().evaluateJavaScript(self.userScript)
             for userscript in settings.userscripts:
                 if userscript["start"] == True:
@@ -578,6 +605,8 @@ delete __NimbusAdRemoverQueries;""" % (settings.adremover_filters,))
                                             "window.nimbus.onLineEvent.initEvent('online',true,false);")
         self.mainFrame().evaluateJavaScript("window.nimbus.offLineEvent = document.createEvent('Event');\n" + \
                                             "window.nimbus.offLineEvent.initEvent('offline',true,false);")
+        self._navigatorOnline = None
+        self.setNavigatorOnline()
 
     # Creates Qt-based plugins.
     # One plugin pertains to the settings dialog,
@@ -803,6 +832,12 @@ class WebView(QWebView):
         super(WebView, self).wheelEvent(*args, **kwargs)
         self.statusMessageDisplay.hide()
 
+    # Catch up on connectivity changes made while the tab was hidden.
+    def showEvent(self, *args, **kwargs):
+        super(WebView, self).showEvent(*args, **kwargs)
+        try: self.page().setNavigatorOnline()
+        except: pass
+
     def disconnect(self, *args, **kwargs):
         super(WebView, self).disconnect(*args, **kwargs)
         self.init()
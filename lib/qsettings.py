@@ -22,6 +22,8 @@ class QSettings(object):
             os.makedirs(self.fulldirname)
         self.fname = fname + ".json"
         self.tables = {}
+        # Functions called with the key whenever a setting changes.
+        self.observers = []
         if os.path.isfile(self.fileName()):
             try: f = open(self.fileName(), "r")
             except: pass
@@ -33,9 +35,13 @@ class QSettings(object):
         return os.path.join(self.fulldirname, self.fname)
     def setValue(self, key, value):
         self.tables[key] = value
+        for observer in self.observers:
+            observer(key)
     def deleteKey(self, key):
         try: del self.tables[key]
         except: pass
+        for observer in self.observers:
+            observer(key)
     def value(self, key):
         try: return self.tables[key]
         except: return None
@@ -47,6 +47,7 @@ default_settings = {"proxy/Type": "None",
                     "proxy/Password": "",
                     "network/DnsPrefetchingEnabled": False,
                     "network/XSSAuditingEnabled": False,
+                    "network/RequestJournalSize": 0,
                     "content/AutoLoadImages": True,
                     "navigation/CaretBrowsingEnabled": False,
                     "navigation/SpatialNavigationEnabled": False,
@@ -66,11 +67,14 @@ default_settings = {"proxy/Type": "None",
                     "general/DuplicateTabs": False,
                     "content/AdremoverFilters": """["#guser > nobr > #gbe", "#HOME_TOP_RIGHT_BOXAD", "#TOP_RIGHT_BOXAD", "#WikiaTopAds", ".headerads", ".home-top-right-ads", ".home_right_column", ".SelfServeUrl", ".adcode_container", ".ad-blocking-makes-fella-confused", "div[id*='adcode']", "div[id*='div-gpt-ad']", "div[class*='sleekadbubble']", "div[class*='gr-adcast']", "div[class*='textbanner-ad']", "div[class*='dp-ad-visible']", "div[class*='partial-ad']", "iframe[src*='/ads/']", "div[style='text-align: center; margin: 0px auto; width:160px; height:600px; position:relative;']", "div[id*='pw_adbox']", "#headerad"]""",
                     "content/HostFilterEnabled": True,
+                    "content/FilterCacheSize": 4096,
+                    "content/FilterStatisticsEnabled": False,
                     "content/ReplaceHTML5MediaTagsWithEmbedTags": (True if "win" in sys.platform else False),
                     "content/UseOnlineContentViewers": False,
                     "content/TiledBackingStoreEnabled": False,
                     "content/FlashEnabled": True,
                     "content/GIFsEnabled": True,
+                    "content/KittensEnabled": False,
                     "content/SiteSpecificQuirksEnabled": True,
                     "general/Homepage": startpage if sys.platform.startswith("win") else startpage_short,
                     "general/Search": "%s",
@@ -106,20 +110,84 @@ for setting, value in default_settings.items():
 
 settings.hardSync()
 
-def setting_to_bool(value=""):
-    try: return bool(eval(str(settings.value(value)).title()))
+# Parsers for setting values, which may have been stored as strings.
+def parse_bool(value):
+    if type(value) is str:
+        value = value.strip().title()
+        if value in ("True", "False", "None", ""):
+            return value == "True"
+        try: return bool(float(value))
+        except: return False
+    try: return bool(value)
     except: return False
 
-def setting_to_int(value=""):
-    try: return int(settings.value(value))
+def parse_int(value):
+    try: return int(value)
     except: return 0
 
+def parse_list(value):
+    if type(value) is list:
+        return value
+    try: return json.loads(value)
+    except: return []
+
+def parse_str(value):
+    return "" if value is None else str(value)
+
+parsers = {bool: parse_bool, int: parse_int, list: parse_list, str: parse_str}
+
+# Typed, cached view of the settings. Each setting is parsed once and kept
+# until it is changed with setValue, so hot paths don't parse strings on
+# every read. Settings in default_settings can be read as attributes named
+# after the last part of their key, as in typed.HostFilterEnabled, and get
+# the type of their default value.
+class TypedSettings(object):
+    def __init__(self, settings, defaults):
+        super(TypedSettings, self).__init__()
+        self._settings = settings
+        self._cache = {}
+        self._names = {}
+        for key, value in defaults.items():
+            parser = parsers.get(type(value), parse_str)
+            self._names[key.split("/")[-1]] = (key, parser)
+        settings.observers.append(self.invalidate)
+    def value(self, key, parser=parse_str):
+        try: return self._cache[key, parser]
+        except KeyError:
+            value = parser(self._settings.value(key))
+            self._cache[key, parser] = value
+            return value
+    # Attributes are only looked up here the first time; after that they
+    # are plain instance attributes.
+    def __getattr__(self, name):
+        try: key, parser = self.__dict__["_names"][name]
+        except KeyError:
+            raise AttributeError(name)
+        value = self.value(key, parser)
+        self.__dict__[name] = value
+        return value
+    def invalidate(self, key=None):
+        if key is None:
+            self._cache.clear()
+            for name in self._names:
+                self.__dict__.pop(name, None)
+            return
+        for parser in parsers.values():
+            self._cache.pop((key, parser), None)
+        name = key.split("/")[-1]
+        if self._names.get(name, (None,))[0] == key:
+            self.__dict__.pop(name, None)
+
+typed = TypedSettings(settings, default_settings)
+
+def setting_to_bool(value=""):
+    return typed.value(value, parse_bool)
+
+def setting_to_int(value=""):
+    return typed.value(value, parse_int)
+
 def setting_to_list(value=""):
-    if type(settings.value(value)) is list:
-        return settings.value(value)
-    else:
-        try: return json.loads(settings.value(value))
-        except: return []
+    return typed.value(value, parse_list)
 
 js_exceptions = setting_to_list("content/JavaScriptExceptions")
 
@@ -16,6 +16,7 @@ import settings
 import browser
 import custom_widgets
 import filtering
+import network
 import data
 import clear_history_dialog
 from translate import tr
@@ -302,6 +303,10 @@ class ContentSettingsPanel(SettingsPanel):
         # Replace ads with kittens!
         self.kittensToggle = QCheckBox(tr("Enable &kittens"), self)
         contentFilteringRow2.layout().addWidget(self.kittensToggle)
+
+        # Collect statistics on which filters fire. See nimbus:filterstats.
+        self.filterStatisticsToggle = QCheckBox(tr("Collect filter &statistics"), self)
+        self.contentFilteringGroupBox.layout().addWidget(self.filterStatisticsToggle)
         
         self.updateFilteringButton = QPushButton(tr("Update content filters"), self.contentFilteringGroupBox)
         self.updateFilteringButton.clicked.connect(self.updateFilters)
@@ -349,6 +354,7 @@ class ContentSettingsPanel(SettingsPanel):
         self.gifsToggle.setChecked(not settings.setting_to_bool("content/GIFsEnabled"))
         self.hostFilterToggle.setChecked(settings.setting_to_bool("content/HostFilterEnabled"))
         self.kittensToggle.setChecked(settings.setting_to_bool("content/KittensEnabled"))
+        self.filterStatisticsToggle.setChecked(settings.setting_to_bool("content/FilterStatisticsEnabled"))
         self.mediaToggle.setChecked(settings.setting_to_bool("content/ReplaceHTML5MediaTagsWithEmbedTags"))
         self.contentViewersToggle.setChecked(settings.setting_to_bool("content/UseOnlineContentViewers"))
         self.tiledBackingStoreToggle.setChecked(settings.setting_to_bool("content/TiledBackingStoreEnabled"))
@@ -372,6 +378,8 @@ class ContentSettingsPanel(SettingsPanel):
         settings.settings.setValue("content/GIFsEnabled", not self.gifsToggle.isChecked())
         settings.settings.setValue("content/HostFilterEnabled", self.hostFilterToggle.isChecked())
         settings.settings.setValue("content/KittensEnabled", self.kittensToggle.isChecked())
+        settings.settings.setValue("content/FilterStatisticsEnabled", self.filterStatisticsToggle.isChecked())
+        filtering.enable_statistics(self.filterStatisticsToggle.isChecked())
         settings.settings.setValue("content/ReplaceHTML5MediaTagsWithEmbedTags", self.mediaToggle.isChecked())
         filtering.adblock_filter_loader.start()
         settings.settings.setValue("content/UseOnlineContentViewers", self.contentViewersToggle.isChecked())
@@ -451,12 +459,12 @@ class DataSettingsPanel(SettingsPanel):
         self.layout().addWidget(self.maximumURLLengthRow)
 
         # Maximum cache size spinbox.
-        # The cache is gone because it fucks Nimbus with a chainsaw.
-        #self.maximumCacheSizeRow = custom_widgets.SpinBoxRow(tr("Maximum cache size:"), self)
-        #self.maximumCacheSizeRow.expander.setText(tr("MB"))
-        #self.maximumCacheSize = self.maximumCacheSizeRow.spinBox
-        #self.maximumCacheSize.setMaximum(20000)
-        #self.layout().addWidget(self.maximumCacheSizeRow)
+        self.maximumCacheSizeRow = custom_widgets.SpinBoxRow(tr("Maximum cache size:"), self)
+        self.maximumCacheSizeRow.expander.setText(tr("MB"))
+        self.maximumCacheSize = self.maximumCacheSizeRow.spinBox
+        self.maximumCacheSize.setMinimum(1)
+        self.maximumCacheSize.setMaximum(20000)
+        self.layout().addWidget(self.maximumCacheSizeRow)
 
         # Checkbox to toggle geolocation.
         self.geolocationToggle = QCheckBox(tr("Enable geo&location"), self)
@@ -499,7 +507,7 @@ class DataSettingsPanel(SettingsPanel):
         self.layout().addWidget(custom_widgets.Expander(self))
     def loadSettings(self):
         self.maximumURLLength.setValue(settings.setting_to_int("data/MaximumURLLength"))
-        #self.maximumCacheSize.setValue(settings.setting_to_int("data/MaximumCacheSize"))
+        self.maximumCacheSize.setValue(settings.setting_to_int("data/MaximumCacheSize"))
         self.rememberHistoryToggle.setChecked(settings.setting_to_bool("data/RememberHistory"))
         self.geolocationToggle.setChecked(settings.setting_to_bool("network/GeolocationEnabled"))
         self.geolocationWhitelist.clear()
@@ -510,7 +518,8 @@ class DataSettingsPanel(SettingsPanel):
             self.geolocationBlacklist.addItem(url)
     def saveSettings(self):
         settings.settings.setValue("data/MaximumURLLength", self.maximumURLLength.value())
-        #settings.settings.setValue("data/MaximumCacheSize", self.maximumCacheSize.value())
+        settings.settings.setValue("data/MaximumCacheSize", self.maximumCacheSize.value())
+        network.apply_cache_settings()
         settings.settings.setValue("data/RememberHistory", self.rememberHistoryToggle.isChecked())
         settings.settings.setValue("network/GeolocationEnabled", self.geolocationToggle.isChecked())
         data.geolocation_whitelist = [self.geolocationWhitelist.item(authority).text() for authority in range(0, self.geolocationWhitelist.count())]
@@ -612,6 +621,15 @@ class NetworkSettingsPanel(SettingsPanel):
         self.xssAuditingToggle = QCheckBox(tr("Enable X&SS auditing"), self)
         self.layout().addWidget(self.xssAuditingToggle)
 
+        # Number of recent requests to show on nimbus:requests.
+        self.requestJournalSizeRow = custom_widgets.SpinBoxRow(tr("Requests to record:"), self)
+        self.requestJournalSizeRow.expander.hide()
+        self.requestJournalSize = self.requestJournalSizeRow.spinBox
+        self.requestJournalSize.setSpecialValueText(tr("Off"))
+        self.requestJournalSize.setMaximum(100000)
+        self.requestJournalSize.setSingleStep(100)
+        self.layout().addWidget(self.requestJournalSizeRow)
+
         # Proxy label.
         proxyLabel = QLabel(tr("<b>Proxy configuration</b>"))
         self.layout().addWidget(proxyLabel)
@@ -669,6 +687,7 @@ class NetworkSettingsPanel(SettingsPanel):
         self.passwordEntry.setText(str(settings.settings.value("proxy/Password")))
         self.xssAuditingToggle.setChecked(settings.setting_to_bool("network/XSSAuditingEnabled"))
         self.dnsPrefetchingToggle.setChecked(settings.setting_to_bool("network/DnsPrefetchingEnabled"))
+        self.requestJournalSize.setValue(settings.setting_to_int("network/RequestJournalSize"))
         port = settings.setting_to_int("proxy/Port")
         if port == "None":
             port = str(settings.default_port)
@@ -685,6 +704,8 @@ class NetworkSettingsPanel(SettingsPanel):
             proxyType = "No"
         settings.settings.setValue("network/XSSAuditingEnabled", self.xssAuditingToggle.isChecked())
         settings.settings.setValue("network/DnsPrefetchingEnabled", self.dnsPrefetchingToggle.isChecked())
+        settings.settings.setValue("network/RequestJournalSize", self.requestJournalSize.value())
+        network.request_journal.resize(self.requestJournalSize.value())
         settings.settings.setValue("proxy/Type", proxyType)
         settings.settings.setValue("proxy/Port", self.portEntry.value())
         settings.settings.setValue("proxy/User", self.userEntry.text())